@@ -0,0 +1,90 @@
+'''Compares latency and memory of the detail json read from the consumption
+   table and from the memory-mapped array store.
+
+   Usage: python benchmarks/bench_detail_store.py [--repeat N]
+                                                  [--resolution R]
+
+   Runs against the configured db, which should hold imported data. Each
+   source is measured in its own process, building the detail json of every
+   user --repeat times, and the growth of the peak RSS of that process over
+   the run is reported next to the median and p99 latency. The array store
+   is built from the db into a temporary directory first, deleted when the
+   process exits.'''
+
+import os
+import sys
+import json
+import time
+import atexit
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'dashboard'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dashboard.settings')
+
+
+def peak_rss():
+    '''Returns the peak RSS of this process in MB (ru_maxrss is in KB on
+       linux).'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(source, repeat, resolution):
+    '''Builds the detail json of every user from source and returns the
+       latencies in ms and the peak RSS growth in MB.'''
+    import django
+    from django.conf import settings
+    if source == 'arrays':
+        settings.CONSUMPTION_ARRAY_DIR = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, settings.CONSUMPTION_ARRAY_DIR,
+                        ignore_errors=True)
+    django.setup()
+    from django.core.management import call_command
+    from consumption.models import User_data
+    from consumption.views import detail_payload
+    if source == 'arrays':
+        call_command('array_sync', verbosity=0)
+    user_ids = list(User_data.objects.values_list('id', flat=True))
+    detail_payload(user_ids[0], resolution=resolution)
+    # imports and query compilation are not part of the measurement
+    baseline = peak_rss()
+    latencies = []
+    for _ in range(repeat):
+        for user_id in user_ids:
+            start = time.perf_counter()
+            detail_payload(user_id, resolution=resolution)
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {'source': source, 'requests': len(latencies),
+            'p50_ms': latencies[len(latencies) // 2],
+            'p99_ms': latencies[int(len(latencies) * 0.99)],
+            'peak_rss_growth_mb': peak_rss() - baseline}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--resolution', default='monthly')
+    parser.add_argument('--source', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.source:
+        print(json.dumps(measure(args.source, args.repeat, args.resolution)))
+        return
+    for source in ['orm', 'arrays']:
+        output = subprocess.run(
+            [sys.executable, __file__, '--source', source,
+             '--repeat', str(args.repeat), '--resolution', args.resolution],
+            check=True, stdout=subprocess.PIPE).stdout
+        result = json.loads(output.decode().splitlines()[-1])
+        print(f'{source:>7}: p50 {result["p50_ms"]:7.1f}ms'
+              f' p99 {result["p99_ms"]:7.1f}ms, peak RSS'
+              f' +{result["peak_rss_growth_mb"]:.1f}MB over'
+              f' {result["requests"]} requests')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+'''Compares the rows per second of the consumption loaders.
+
+   Usage: python benchmarks/bench_import.py [--data-dir DIR] [--repeat N]
+
+   The files are parsed once up front so only the db writes are timed. The
+   benchmark runs against a throw away sqlite db unless --use-settings-db is
+   given, in which case the configured db (e.g. postgresql) is used and its
+   consumption table is emptied.'''
+
+import os
+import sys
+import time
+import atexit
+import shutil
+import argparse
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'dashboard'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dashboard.settings')
+
+
+def setup_django(use_settings_db):
+    '''Configures django, pointing it at a temporary sqlite db, deleted on
+       exit, unless the configured db should be used.'''
+    import django
+    from django.conf import settings
+    if not use_settings_db:
+        db_dir = tempfile.mkdtemp()
+        atexit.register(shutil.rmtree, db_dir, ignore_errors=True)
+        settings.DATABASES['default']['NAME'] = os.path.join(db_dir,
+                                                             'bench.sqlite3')
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data-dir', default=os.path.join(ROOT, 'data'))
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--use-settings-db', action='store_true')
+    args = parser.parse_args()
+    setup_django(args.use_settings_db)
+
+    from importlib import import_module
+    from django.db import connection
+    from consumption.models import Consumption
+    from consumption.loaders import get_loader
+    importer_module = import_module('consumption.management.commands.import')
+
+    importer = importer_module.Importer(batch_size=args.batch_size)
+    importer.logger.disabled = True
+    importer.import_user_data(os.path.join(args.data_dir, 'user_data.csv'))
+    frames = importer.read_consumption_files(importer.consumption_files(
+        os.path.join(args.data_dir, 'consumption')))
+    batches = list(importer.consumption_batches(frames))
+    rows = sum(len(batch) for batch in batches)
+    print(f'{rows} rows in {len(batches)} batches on {connection.vendor}')
+
+    results = {}
+    for name in ['orm', 'native']:
+        timings = []
+        for _ in range(args.repeat):
+            Consumption.objects.all().delete()
+            start = time.perf_counter()
+            with get_loader(name) as loader:
+                for batch in batches:
+                    importer.write_consumption_batch(loader, batch)
+            timings.append(time.perf_counter() - start)
+        assert Consumption.objects.count() == rows
+        results[name] = rows / min(timings)
+        print(f'{name:>8}: {min(timings):8.2f}s {results[name]:12,.0f}'
+              ' rows/s')
+    print(f'native is {results["native"] / results["orm"]:.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
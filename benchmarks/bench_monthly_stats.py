@@ -0,0 +1,73 @@
+'''Micro benchmark of the monthly aggregation of detail_search_api.
+
+   Usage: python benchmarks/bench_monthly_stats.py [--years N] [--repeat N]
+
+   Compares the previous implementation, a .where() mask over the whole
+   column for every month, with the single grouped pass of
+   consumption.series.downsample on a synthetic half hourly history.'''
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'dashboard'))
+
+from consumption.series import downsample  # noqa: E402
+
+
+def loop_monthly_stats(datetimes, consumption):
+    '''The aggregation detail_search_api used before consumption.series.'''
+    df = pd.DataFrame({'consumption__datetime': datetimes,
+                       'consumption__consumption': consumption})
+    df['month'] = pd.to_datetime(
+        df['consumption__datetime']).dt.strftime('%b-%Y')
+    consumption_data = []
+    sem = []
+    for i in df['month'].unique():
+        consumption_data.append(df['consumption__consumption'].where(
+            df['month'] == i).mean().round(2))
+        sem.append(df['consumption__consumption'].where(
+            df['month'] == i).sem().round(2))
+    return list(df['month'].unique()), consumption_data, sem
+
+
+def monthly_stats(datetimes, consumption):
+    series = downsample(datetimes, consumption, 'monthly')
+    return series['x_axis'], series['y_axis'], series['sem']
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--years', type=int, nargs='+', default=[1, 5, 10])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    for years in args.years:
+        datetimes = pd.date_range('2010-01-01', periods=years * 365 * 48,
+                                  freq='30min').to_pydatetime()
+        consumption = rng.gamma(2.0, 200.0, len(datetimes)).round()
+        loop, expected = best_of(args.repeat, loop_monthly_stats, datetimes,
+                                 consumption)
+        grouped, result = best_of(args.repeat, monthly_stats, datetimes,
+                                  consumption)
+        assert pd.DataFrame(result).equals(pd.DataFrame(expected))
+        print(f'{years:3d} years, {len(datetimes):8d} rows: loop'
+              f' {loop * 1000:9.1f}ms, grouped {grouped * 1000:7.1f}ms'
+              f' ({loop / grouped:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
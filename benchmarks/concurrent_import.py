@@ -0,0 +1,129 @@
+'''Runs API reads while the import writes, for each database profile.
+
+   Usage: python benchmarks/concurrent_import.py [--profiles P ...]
+                                                 [--users N] [--years N]
+                                                 [--timeout SECONDS]
+
+   Every profile runs in its own process against a throw away sqlite db
+   with the dummy cache. The users are imported first, then a thread
+   imports the consumption data while the main thread keeps requesting the
+   summary json and the raw detail json of the users until the import is
+   done. The p50/p99 and maximum latency of the reads, the reads failing
+   with "database is locked" and the duration of the import are
+   reported. --timeout overrides how long a connection waits for a lock,
+   a short one shows every read a write transaction blocks.'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'dashboard'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dashboard.settings')
+
+from generate import generate, FIRST_ID  # noqa: E402
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run_profile(users, years, timeout=None):
+    '''Imports and reads at the same time in the profile of DB_PROFILE,
+       returns its results. The data and the db are deleted afterwards.'''
+    with tempfile.TemporaryDirectory() as work_dir:
+        return profile(work_dir, users, years, timeout)
+
+
+def profile(work_dir, users, years, timeout):
+    data_dir = os.path.join(work_dir, 'data')
+    generate(data_dir, users, years)
+    import django
+    from django.conf import settings
+    settings.DATABASES['default']['NAME'] = os.path.join(work_dir,
+                                                         'bench.sqlite3')
+    if timeout is not None:
+        settings.DATABASES['default']['OPTIONS'] = dict(
+            settings.DATABASES['default'].get('OPTIONS', {}), timeout=timeout)
+    settings.CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    settings.ALLOWED_HOSTS = ['testserver']
+    django.setup()
+    from importlib import import_module
+    from django.core.management import call_command
+    from django.db import OperationalError, connection
+    from django.test import Client
+    call_command('migrate', verbosity=0)
+    importer = import_module(
+        'consumption.management.commands.import').Importer()
+    importer.logger.disabled = True
+    importer.import_user_data(os.path.join(data_dir, 'user_data.csv'))
+
+    def import_consumption():
+        try:
+            importer.import_consumption_data(os.path.join(data_dir,
+                                                          'consumption'))
+        finally:
+            connection.close()
+    thread = threading.Thread(target=import_consumption)
+    client = Client()
+    latencies = []
+    locked = 0
+    start = time.perf_counter()
+    thread.start()
+    while thread.is_alive():
+        user_id = FIRST_ID + len(latencies) % users
+        for path in ['/api/summary/', '/api/detail_search/find/'
+                     f'?id_search={user_id}&resolution=raw']:
+            request_start = time.perf_counter()
+            try:
+                client.get(path)
+            except OperationalError:
+                locked += 1
+                continue
+            latencies.append((time.perf_counter() - request_start) * 1000)
+    thread.join()
+    return {'profile': settings.DB_PROFILE,
+            'import_seconds': time.perf_counter() - start,
+            'reads': len(latencies), 'locked': locked,
+            'p50_ms': percentile(latencies, 0.5) if latencies else None,
+            'p99_ms': percentile(latencies, 0.99) if latencies else None,
+            'max_ms': max(latencies, default=None)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--profiles', nargs='+',
+                        default=['development', 'production'])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--years', type=int, default=1)
+    parser.add_argument('--timeout', type=float)
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(run_profile(args.users, args.years, args.timeout)))
+        return
+    for profile in args.profiles:
+        output = subprocess.run(
+            [sys.executable, __file__, '--child', '--users', str(args.users),
+             '--years', str(args.years)]
+            + ([] if args.timeout is None else ['--timeout',
+                                                str(args.timeout)]),
+            env=dict(os.environ, DB_PROFILE=profile), check=True,
+            stdout=subprocess.PIPE).stdout
+        result = json.loads(output.decode().splitlines()[-1])
+        print(f'{profile:>12}: import {result["import_seconds"]:.1f}s,'
+              f' {result["reads"]} reads p50 {result["p50_ms"]:.1f}ms'
+              f' p99 {result["p99_ms"]:.1f}ms max {result["max_ms"]:.1f}ms,'
+              f' {result["locked"]} locked')
+
+
+if __name__ == '__main__':
+    main()
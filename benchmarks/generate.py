@@ -0,0 +1,56 @@
+'''Writes a synthetic data directory in the layout of data/.
+
+   Usage: python benchmarks/generate.py DIR [--users N] [--years N]
+                                            [--seed N]
+
+   DIR gets a user_data.csv with N users spread over 4 areas and 3 tariffs
+   and a consumption/<id>.csv per user with half hourly readings for N
+   years, a daily profile with gamma noise rounded to whole numbers like
+   the sample data.'''
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+FIRST_ID = 3000
+START = '2016-01-01'
+
+
+def generate(data_dir, users, years, seed=0):
+    '''Writes the data directory and returns the number of readings.'''
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(data_dir, 'consumption'), exist_ok=True)
+    ids = np.arange(FIRST_ID, FIRST_ID + users)
+    pd.DataFrame({'id': ids,
+                  'area': [f'a{i % 4 + 1}' for i in range(users)],
+                  'tariff': [f't{i % 3 + 1}' for i in range(users)]}).to_csv(
+        os.path.join(data_dir, 'user_data.csv'), index=False)
+    datetimes = pd.date_range(START, periods=years * 365 * 48, freq='30min')
+    hours = datetimes.hour.values + datetimes.minute.values / 60
+    profile = 150 + 100 * np.sin((hours - 6) / 24 * 2 * np.pi)
+    labels = datetimes.strftime('%Y-%m-%d %H:%M:%S')
+    for user_id in ids:
+        consumption = (profile * rng.uniform(0.5, 1.5)
+                       * rng.gamma(4.0, 0.25, len(datetimes))).round()
+        pd.DataFrame({'datetime': labels,
+                      'consumption': consumption}).to_csv(
+            os.path.join(data_dir, 'consumption', f'{user_id}.csv'),
+            index=False, float_format='%.1f')
+    return users * len(datetimes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('data_dir')
+    parser.add_argument('--users', type=int, default=60)
+    parser.add_argument('--years', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rows = generate(args.data_dir, args.users, args.years, args.seed)
+    print(f'{rows} readings of {args.users} users written to'
+          f' {args.data_dir}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+'''Measures p50/p99 latency of the API under concurrent requests.
+
+   Usage: python benchmarks/load_test.py [--url URL] [--concurrency N ...]
+                                         [--requests N] [--json FILE]
+
+   Sends --requests requests with each concurrency level against a running
+   server, cycling through the summary json and the hourly and raw detail
+   json of the users --ids. Only the standard library is used, one HTTP/1.1
+   connection per request. To compare the servers run for example
+
+       CACHE_BACKEND=django.core.cache.backends.dummy.DummyCache \\
+           gunicorn -w 1 --threads 4 dashboard.wsgi
+       CACHE_BACKEND=django.core.cache.backends.dummy.DummyCache \\
+           uvicorn dashboard.asgi:application
+
+   in the dashboard directory, the dummy cache makes every request do the
+   full work.'''
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+from itertools import cycle
+from urllib.parse import urlsplit
+
+
+async def get(host, port, path):
+    '''Sends a GET request and returns the status code once the whole
+       response was read.'''
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\n'
+                 'Connection: close\r\n\r\n'.encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def run(url, paths, concurrency, requests):
+    '''Sends the requests with at most concurrency in flight and returns
+       (path, status, seconds) of each and the total seconds.'''
+    parts = urlsplit(url)
+    paths = cycle(paths)
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def timed(path):
+        async with semaphore:
+            start = time.perf_counter()
+            status = await get(parts.hostname, parts.port or 80, path)
+            results.append((path, status, time.perf_counter() - start))
+    start = time.perf_counter()
+    await asyncio.gather(*[timed(next(paths)) for _ in range(requests)])
+    return results, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def summarise(results, seconds, concurrency):
+    '''Returns p50/p99 in ms per endpoint and overall and the throughput.'''
+    endpoints = {}
+    for path, status, latency in results:
+        endpoints.setdefault(path.split('?')[0], []).append(latency * 1000)
+    return {'concurrency': concurrency, 'requests': len(results),
+            'errors': sum(status != 200 for _, status, _ in results),
+            'requests_per_s': len(results) / seconds,
+            'p50_ms': percentile([r[2] * 1000 for r in results], 0.5),
+            'p99_ms': percentile([r[2] * 1000 for r in results], 0.99),
+            'endpoints': {endpoint: {'p50_ms': percentile(latencies, 0.5),
+                                     'p99_ms': percentile(latencies, 0.99)}
+                          for endpoint, latencies in endpoints.items()}}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 10, 50])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--ids', type=int, nargs=2, default=[3000, 3059],
+                        metavar=('FIRST', 'LAST'))
+    parser.add_argument('--json', help='File the results are written to.')
+    args = parser.parse_args()
+    paths = []
+    for user_id in range(args.ids[0], args.ids[1] + 1):
+        paths += ['/api/summary/',
+                  f'/api/detail_search/find/?id_search={user_id}'
+                  '&resolution=hourly',
+                  f'/api/detail_search/find/?id_search={user_id}'
+                  '&resolution=raw']
+    summaries = []
+    for concurrency in args.concurrency:
+        summary = summarise(*asyncio.run(run(args.url, paths, concurrency,
+                                             args.requests)), concurrency)
+        summaries.append(summary)
+        print(f'concurrency {concurrency:4d}: p50 {summary["p50_ms"]:8.1f}ms'
+              f' p99 {summary["p99_ms"]:8.1f}ms'
+              f' {summary["requests_per_s"]:7.1f} req/s'
+              f' {summary["errors"]} errors')
+        for endpoint, latency in summary['endpoints'].items():
+            print(f'    {endpoint:28s} p50 {latency["p50_ms"]:8.1f}ms'
+                  f' p99 {latency["p99_ms"]:8.1f}ms')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'url': args.url, 'argv': sys.argv[1:],
+                       'results': summaries}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
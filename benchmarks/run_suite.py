@@ -0,0 +1,190 @@
+'''Runs the import, summary, summary_api and detail_search_api paths on
+   synthetic data of several sizes and writes the results as json.
+
+   Usage: python benchmarks/run_suite.py [--sizes USERSxYEARS ...]
+                                         [--repeat N] [--output FILE]
+                                         [--baseline FILE]
+
+   Every size runs in its own process against a throw away sqlite db with
+   the dummy cache, so each request does the full work. For each path the
+   results hold the throughput or p50/p95 latency over --repeat runs and
+   the peak of the memory traced by tracemalloc during one extra run, the
+   import also the growth of the peak RSS. With --baseline the results are
+   compared to those of an earlier run, e.g. of another commit.'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'dashboard'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dashboard.settings')
+
+from generate import generate, FIRST_ID  # noqa: E402
+
+PATHS = {'summary': '/summary/', 'summary_api': '/api/summary/',
+         'detail_search_api': '/api/detail_search/find/?id_search={id}'}
+
+
+def peak_rss():
+    '''Returns the peak RSS of this process in MB.'''
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def traced_peak(func):
+    '''Returns the peak memory in MB traced while func runs.'''
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def check(name, response):
+    '''Fails unless the response of a path holds its data, an invalid
+       request is answered with 200 and an error.'''
+    assert response.status_code == 200, (name, response.status_code)
+    if name == 'summary':
+        assert b'<table' in response.content, name
+    else:
+        data = response.json()
+        assert isinstance(data, list) and data[0]['x_axis'], (name, data)
+
+
+def setup_django(work_dir):
+    '''Configures django with a new sqlite db in work_dir and the dummy
+       cache.'''
+    import django
+    from django.conf import settings
+    settings.DATABASES['default']['NAME'] = os.path.join(work_dir,
+                                                         'bench.sqlite3')
+    settings.CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    settings.ALLOWED_HOSTS = ['testserver']
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def run_size(users, years, repeat):
+    '''Generates, imports and queries one size, returns its results. The
+       data and the db are deleted afterwards.'''
+    with tempfile.TemporaryDirectory() as work_dir:
+        return measure_size(work_dir, users, years, repeat)
+
+
+def measure_size(work_dir, users, years, repeat):
+    data_dir = os.path.join(work_dir, 'data')
+    rows = generate(data_dir, users, years)
+    setup_django(work_dir)
+    from importlib import import_module
+    from django.test import Client
+    importer = import_module(
+        'consumption.management.commands.import').Importer()
+    importer.logger.disabled = True
+
+    baseline = peak_rss()
+    start = time.perf_counter()
+    importer.import_user_data(os.path.join(data_dir, 'user_data.csv'))
+    imported = importer.import_consumption_data(os.path.join(data_dir,
+                                                             'consumption'))
+    seconds = time.perf_counter() - start
+    assert imported == rows
+    results = {'users': users, 'years': years, 'rows': rows,
+               'import': {'seconds': seconds, 'rows_per_s': rows / seconds,
+                          'peak_rss_growth_mb': peak_rss() - baseline}}
+
+    client = Client()
+    for name, path in PATHS.items():
+        paths = [path.format(id=FIRST_ID + i % users)
+                 for i in range(repeat)]
+        latencies = []
+        for path in paths:
+            start = time.perf_counter()
+            response = client.get(path)
+            latencies.append((time.perf_counter() - start) * 1000)
+            check(name, response)
+        latencies.sort()
+        results[name] = {
+            'p50_ms': latencies[len(latencies) // 2],
+            'p95_ms': latencies[min(int(len(latencies) * 0.95),
+                                    len(latencies) - 1)],
+            'traced_peak_mb': traced_peak(lambda: client.get(paths[0]))}
+    return results
+
+
+def compare(results, baseline):
+    '''Prints the change of every metric against the baseline results of
+       the same size.'''
+    previous = {(result['users'], result['years']): result
+                for result in baseline['results']}
+    for result in results['results']:
+        old = previous.get((result['users'], result['years']))
+        if old is None:
+            continue
+        for name in ['import'] + list(PATHS):
+            for metric, value in result[name].items():
+                before = old.get(name, {}).get(metric)
+                if before:
+                    print(f'{result["users"]}x{result["years"]}'
+                          f' {name}.{metric}: {before:.1f} -> {value:.1f}'
+                          f' ({(value / before - 1) * 100:+.0f}%)')
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                              check=True, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL).stdout.decode()\
+            .strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', nargs='+', default=['10x1', '60x1',
+                                                        '60x3'])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline')
+    parser.add_argument('--size', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.size:
+        users, years = map(int, args.size.split('x'))
+        print(json.dumps(run_size(users, years, args.repeat)))
+        return
+    results = {'commit': git_commit(),
+               'created': datetime.now().isoformat(timespec='seconds'),
+               'python': platform.python_version(),
+               'machine': platform.machine(), 'cpus': os.cpu_count(),
+               'repeat': args.repeat, 'results': []}
+    for size in args.sizes:
+        output = subprocess.run(
+            [sys.executable, __file__, '--size', size,
+             '--repeat', str(args.repeat)],
+            check=True, stdout=subprocess.PIPE).stdout
+        result = json.loads(output.decode().splitlines()[-1])
+        results['results'].append(result)
+        print(f'{size:>7} {result["rows"]:9d} rows: import'
+              f' {result["import"]["rows_per_s"]:9,.0f} rows/s,'
+              + ','.join(f' {name} p50 {result[name]["p50_ms"]:.1f}ms'
+                         for name in PATHS))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
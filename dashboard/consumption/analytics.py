@@ -0,0 +1,121 @@
+'''Anomaly and peak analytics of the users' half hourly readings, stored in
+   the User_day_analytics table.
+
+   The peak of a day, its largest reading and the time of the first
+   reading reaching it, is mergeable like the rollups: every imported batch
+   is reduced to one peak per user and day in a single groupby and a day
+   split over several batches keeps the larger peak. The z-scores are
+   computed once the import wrote its batches, from the daily rollups: the
+   daily means of all users with new readings form one date x user frame,
+   and the baseline of each day is the mean and standard deviation of the
+   user's daily means over the WINDOW days before it, computed for every
+   user at once with a rolling window. Only the days from the first new
+   reading of each user on are written.'''
+
+import datetime
+import pandas as pd
+from django.db import connection, transaction
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+from consumption.models import User_day_rollup, User_day_analytics
+
+WINDOW = 28
+MIN_DAYS = 7
+Z_THRESHOLD = 3.0
+SCORES = ['mean', 'baseline', 'spread', 'z_score']
+
+
+def daily_peaks(batch):
+    '''Returns user_data_id, date, peak and peak_time of every user and day
+       in a batch of readings.'''
+    frame = pd.DataFrame({
+        'user_data_id': batch['user_data_id'].astype(int).values,
+        'date': batch['datetime'].dt.normalize().values,
+        'datetime': batch['datetime'].values,
+        'peak': batch['consumption'].astype(float).values})
+    peaks = frame.loc[frame.groupby(['user_data_id', 'date'])['peak']
+                      .idxmax().values]
+    return pd.DataFrame({'user_data_id': peaks['user_data_id'].values,
+                         'date': peaks['date'].dt.date.values,
+                         'peak': peaks['peak'].values,
+                         'peak_time': peaks['datetime'].dt.time.values})
+
+
+def update_peaks(batch):
+    '''Merges the daily peaks of a batch of readings into the analytics
+       table, this should run in the transaction which writes the batch.'''
+    peaks = daily_peaks(batch)
+    existing = {(row.user_data_id, row.date): row
+                for row in User_day_analytics.objects.filter(
+                    user_data_id__in=peaks['user_data_id'].unique().tolist(),
+                    date__gte=peaks['date'].min(),
+                    date__lte=peaks['date'].max())}
+    updated = []
+    created = []
+    for peak in peaks.to_dict('records'):
+        row = existing.get((peak['user_data_id'], peak['date']))
+        if row is None:
+            created.append(User_day_analytics(**peak))
+        elif peak['peak'] > row.peak:
+            row.peak, row.peak_time = peak['peak'], peak['peak_time']
+            updated.append(row)
+    User_day_analytics.objects.bulk_update(updated, ['peak', 'peak_time'])
+    User_day_analytics.objects.bulk_create(created)
+
+
+def first_days(batch):
+    '''Returns the date of the first reading of every user in a batch.'''
+    return {int(user_id): first.date() for user_id, first in
+            batch.groupby('user_data_id')['datetime'].min().items()}
+
+
+def scores(means):
+    '''Returns the baseline, spread and z-score of a date x user frame of
+       daily means, with a row for every calendar day.'''
+    rolling = means.rolling(WINDOW, min_periods=MIN_DAYS)
+    baseline = rolling.mean().shift(1)
+    spread = rolling.std().shift(1)
+    # the window ends the day before, a day is not part of its baseline
+    z_score = (means - baseline) / spread.where(spread > 0)
+    return baseline, spread, z_score
+
+
+def update_scores(since):
+    '''Recomputes the scores of the days of each user from the date in since
+       (user id: date) on, in one pass over the daily rollups of all these
+       users.'''
+    if not since:
+        return
+    start = min(since.values()) - datetime.timedelta(days=WINDOW)
+    rows = pd.DataFrame(
+        list(User_day_rollup.objects
+             .filter(user_data_id__in=list(since), date__gte=start)
+             .annotate(mean=F('total') / Cast('count', FloatField()))
+             .values_list('date', 'user_data_id', 'mean')),
+        columns=['date', 'user_data_id', 'mean'])
+    if rows.empty:
+        return
+    means = (rows.pivot(index='date', columns='user_data_id', values='mean')
+             .reindex(pd.date_range(rows['date'].min(), rows['date'].max())
+                      .date).rename_axis('date'))
+    frames = dict(zip(SCORES, (means,) + scores(means)))
+    days = pd.concat({name: frame.stack() for name, frame in frames.items()},
+                     axis=1)
+    days = days[days['mean'].notna()].reset_index()
+    days = days[days['date'] >= days['user_data_id'].map(since)]
+    ids = dict(((user_id, date), row_id) for row_id, user_id, date in
+               User_day_analytics.objects.filter(
+                   user_data_id__in=list(since),
+                   date__gte=min(since.values()))
+               .values_list('id', 'user_data_id', 'date'))
+    days['id'] = [ids.get(key) for key in zip(days['user_data_id'],
+                                              days['date'])]
+    days = days[days['id'].notna()]
+    days = days.astype(object).where(days.notna(), None)
+    table = connection.ops.quote_name(User_day_analytics._meta.db_table)
+    columns = ', '.join(f'{connection.ops.quote_name(name)} = %s'
+                        for name in SCORES)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(f'UPDATE {table} SET {columns} WHERE id = %s',
+                           days[SCORES + ['id']].values.tolist())
+        # one statement for all rows, bulk_update builds a CASE per field
@@ -6,3 +6,7 @@ from django.apps import AppConfig
 
 class ConsumptionConfig(AppConfig):
     name = 'consumption'
+
+    def ready(self):
+        from consumption import db
+        db.install()
@@ -0,0 +1,86 @@
+'''Optional per-user store of the readings for the detail views. Each user has
+   one file holding the number of readings followed by two contiguous
+   arrays sorted by datetime, the datetimes as datetime64[s] and the
+   consumption as float32. Files are opened with np.memmap, so reading a
+   range of a user is a binary search and two zero-copy slices instead of a
+   Python object per reading.
+
+   Enabled by setting CONSUMPTION_ARRAY_DIR.'''
+
+import os
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+DATETIME_DTYPE = np.dtype('<M8[s]')
+CONSUMPTION_DTYPE = np.dtype('<f4')
+HEADER = np.dtype('<i8')
+
+
+def enabled():
+    '''Returns whether the array store is configured.'''
+    return bool(getattr(settings, 'CONSUMPTION_ARRAY_DIR', None))
+
+
+def user_path(user_id):
+    if not enabled():
+        raise ImproperlyConfigured('CONSUMPTION_ARRAY_DIR is not set.')
+    return os.path.join(settings.CONSUMPTION_ARRAY_DIR, f'{user_id}.bin')
+
+
+def open_user(user_id):
+    '''Returns the memory-mapped datetimes and consumption of a user, empty
+       arrays when the user has no readings in the store. Both arrays are
+       mapped from the same open file, so a concurrent rewrite of the file
+       is never seen half way.'''
+    try:
+        f = open(user_path(user_id), 'rb')
+    except FileNotFoundError:
+        return np.empty(0, DATETIME_DTYPE), np.empty(0, CONSUMPTION_DTYPE)
+    with f:
+        count = int(np.frombuffer(f.read(HEADER.itemsize), HEADER)[0])
+        if not count:
+            return (np.empty(0, DATETIME_DTYPE),
+                    np.empty(0, CONSUMPTION_DTYPE))
+        datetimes = np.memmap(f, DATETIME_DTYPE, 'r', HEADER.itemsize,
+                              (count,))
+        consumption = np.memmap(f, CONSUMPTION_DTYPE, 'r',
+                                HEADER.itemsize + datetimes.nbytes, (count,))
+    return datetimes, consumption
+
+
+def read_user(user_id, start=None, end=None):
+    '''Returns views of a user's datetimes and consumption from start
+       (inclusive) to end (exclusive), nothing is copied.'''
+    datetimes, consumption = open_user(user_id)
+    first = (0 if start is None else np.searchsorted(
+        datetimes, np.datetime64(start, 's'), 'left'))
+    last = (len(datetimes) if end is None else np.searchsorted(
+        datetimes, np.datetime64(end, 's'), 'left'))
+    return datetimes[first:last], consumption[first:last]
+
+
+def write_user(user_id, datetimes, consumption):
+    '''Replaces the file of a user. It is written next to the old one and
+       renamed over it, open maps keep reading the old data.'''
+    os.makedirs(settings.CONSUMPTION_ARRAY_DIR, exist_ok=True)
+    datetimes = np.asarray(datetimes).astype(DATETIME_DTYPE)
+    order = np.argsort(datetimes, kind='stable')
+    path = user_path(user_id)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(np.array(len(datetimes), HEADER).tobytes())
+        f.write(np.ascontiguousarray(datetimes[order]).tobytes())
+        f.write(np.ascontiguousarray(np.asarray(consumption)[order],
+                                     CONSUMPTION_DTYPE).tobytes())
+    os.replace(path + '.tmp', path)
+
+
+def append_batch(batch):
+    '''Adds a batch of imported readings to the files of its users.'''
+    for user_id, frame in batch.groupby('user_data_id'):
+        datetimes, consumption = open_user(int(user_id))
+        write_user(int(user_id),
+                   np.concatenate([datetimes, frame['datetime'].values
+                                   .astype(DATETIME_DTYPE)]),
+                   np.concatenate([consumption, frame['consumption'].values
+                                   .astype(CONSUMPTION_DTYPE)]))
@@ -0,0 +1,113 @@
+'''Caching of the summary tables and json payloads. The data only changes
+   when the import runs, which bumps the data version stored in the db.
+   The version is part of every cache key so entries of an older version
+   are never read again and are evicted by the cache backend. The same
+   version is the ETag of the API responses, so clients can revalidate
+   their copy without the payload being built or sent again.'''
+
+from contextvars import ContextVar
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from consumption.models import Data_version
+
+_version = ContextVar('consumption_data_version', default=None)
+
+
+def data_version():
+    '''Returns the current Data_version row, creating it on first use. While
+       a conditional view runs the row it read is reused.'''
+    version = _version.get()
+    if version is None:
+        version = Data_version.objects.get_or_create(id=1)[0]
+    return version
+
+
+def bump_data_version():
+    '''Marks the data as changed, invalidating every cached entry.'''
+    data_version()
+    Data_version.objects.filter(id=1).update(version=F('version') + 1,
+                                             updated=timezone.now())
+
+
+def version_key():
+    '''Returns the data version as used in cache keys, the time of the last
+       bump is included so keys are not reused when the db is recreated
+       while a persistent cache is kept.'''
+    return version_tag(data_version())
+
+
+def version_tag(version):
+    return f'{version.version}.{version.updated.timestamp()}'
+
+
+def cache_key(endpoint, *key_parts):
+    '''Returns the key of the endpoint and key parts (e.g. the id_search) at
+       the current data version. Datetimes are used in iso format so keys
+       contain no spaces.'''
+    return ':'.join(['consumption', endpoint, version_key()]
+                    + [part.isoformat() if hasattr(part, 'isoformat')
+                       else str(part) for part in key_parts])
+
+
+def cached(endpoint, build, *key_parts):
+    '''Returns the value cached for the endpoint and key parts at the
+       current data version, calling build to create it on a miss. A build
+       returning None is not cached.'''
+    key = cache_key(endpoint, *key_parts)
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        if value is not None:
+            cache.set(key, value)
+    return value
+
+
+def lookup(endpoint, *key_parts):
+    '''Returns the key and the cached value (None on a miss) in one call.'''
+    key = cache_key(endpoint, *key_parts)
+    return key, cache.get(key)
+
+
+async def cached_async(endpoint, build, *key_parts):
+    '''Like cached for the async views, build is awaited on a miss. The
+       version query and the cache backend run in the thread of the sync
+       code.'''
+    key, value = await sync_to_async(lookup)(endpoint, *key_parts)
+    if value is None:
+        value = await build()
+        if value is not None:
+            await sync_to_async(cache.set)(key, value)
+    return value
+
+
+def conditional(view):
+    '''Decorates an async view whose response only depends on the request
+       and the data version. Responses get the version as ETag and the time
+       of the last import as Last-Modified and must be revalidated, a
+       client holding the current version gets 304 Not Modified without
+       the view running.'''
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        version = await sync_to_async(data_version)()
+        etag = quote_etag(version_tag(version))
+        last_modified = int(version.updated.timestamp())
+        response = get_conditional_response(request, etag=etag,
+                                            last_modified=last_modified)
+        if response is None:
+            token = _version.set(version)
+            try:
+                response = await view(request, *args, **kwargs)
+            finally:
+                _version.reset(token)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, no_cache=True)
+        return response
+    return wrapper
@@ -0,0 +1,235 @@
+'''Optional columnar storage of the readings in Arrow IPC files, one file per
+   user and month partitioned like user=3000/month=2016-07/data.arrow. The
+   files are memory-mapped when read, aggregations only read the columns
+   they need and only the partitions of the requested users and months,
+   found by listing the directories of these users rather than the store.
+
+   Months archived out of the consumption table by columnar_sync are only
+   in the store, the first month still in the table is kept in the
+   ARCHIVE_FILE of the store and split() tells the views which part of a
+   range to read from where.
+
+   Enabled by setting CONSUMPTION_COLUMNAR_DIR, requires pyarrow.'''
+
+import os
+import pandas as pd
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs as pafs
+except ImportError:
+    pa = None
+
+SCHEMA = None if pa is None else pa.schema([('datetime', pa.timestamp('us')),
+                                            ('consumption', pa.float64())])
+PARTITIONING = None if pa is None else ds.partitioning(
+    pa.schema([('user', pa.int64()), ('month', pa.string())]),
+    flavor='hive')
+FILE_NAME = 'data.arrow'
+ARCHIVE_FILE = '_archived_before'
+ARCHIVE_USERS = 100
+# files starting with _ are ignored by the dataset
+
+
+def enabled():
+    '''Returns whether the columnar store is configured.'''
+    return bool(getattr(settings, 'CONSUMPTION_COLUMNAR_DIR', None))
+
+
+def root():
+    '''Returns the directory of the store, failing when the store is not
+       configured or pyarrow is missing.'''
+    if not enabled():
+        raise ImproperlyConfigured('CONSUMPTION_COLUMNAR_DIR is not set.')
+    if pa is None:
+        raise ImproperlyConfigured('The columnar store requires pyarrow.')
+    return settings.CONSUMPTION_COLUMNAR_DIR
+
+
+def archived_before():
+    '''Returns the first month whose readings are still in the consumption
+       table, None when the store is disabled or nothing was archived.'''
+    if not enabled():
+        return None
+    try:
+        with open(os.path.join(root(), ARCHIVE_FILE)) as f:
+            return pd.Timestamp(f.read().strip()).to_pydatetime()
+    except FileNotFoundError:
+        return None
+
+
+def set_archived_before(month):
+    '''Records that the readings before month were archived, the boundary
+       only moves forward.'''
+    previous = archived_before()
+    if previous is not None and previous >= month:
+        return
+    os.makedirs(root(), exist_ok=True)
+    path = os.path.join(root(), ARCHIVE_FILE)
+    with open(path + '.tmp', 'w') as f:
+        f.write(f'{month:%Y-%m-%d}')
+    os.replace(path + '.tmp', path)
+
+
+def split(start=None, end=None):
+    '''Splits the range from start (inclusive) to end (exclusive) at the
+       archive boundary, returns the range of the archived readings in the
+       store and the range of the readings in the consumption table, each
+       None when it is empty.'''
+    boundary = archived_before()
+    if boundary is None:
+        return None, (start, end)
+    archived = (start, boundary if end is None else min(end, boundary))
+    current = (boundary if start is None else max(start, boundary), end)
+    return (archived if archived[0] is None or archived[0] < archived[1]
+            else None,
+            current if current[1] is None or current[0] < current[1]
+            else None)
+
+
+def partition_path(user_id, month):
+    return os.path.join(root(), f'user={user_id}', f'month={month}',
+                        FILE_NAME)
+
+
+def read_partition(path):
+    '''Returns the table of one partition file, memory-mapped.'''
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def write_partition(user_id, month, frame, append=True):
+    '''Writes the readings of one user and month. With append the existing
+       readings of the partition are kept, the file is replaced atomically
+       so readers never see a partial file.'''
+    path = partition_path(user_id, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(frame[['datetime', 'consumption']],
+                                 schema=SCHEMA, preserve_index=False)
+    if append and os.path.exists(path):
+        table = pa.concat_tables([read_partition(path), table])
+    table = table.sort_by('datetime')
+    temp_path = os.path.join(os.path.dirname(path), '.' + FILE_NAME)
+    # dot files are ignored by the dataset while they are written
+    with pa.OSFile(temp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, SCHEMA) as writer:
+            writer.write_table(table)
+    os.replace(temp_path, path)
+
+
+def write_batch(batch):
+    '''Adds a batch of imported readings to the partitions of their users
+       and months.'''
+    months = batch['datetime'].dt.strftime('%Y-%m')
+    for (user_id, month), frame in batch.groupby(
+            [batch['user_data_id'], months]):
+        write_partition(int(user_id), month, frame)
+
+
+def partition_files(user_ids=None, start=None, end=None):
+    '''Returns the partition files of the users, all users when None, and
+       of the months overlapping the range from start (inclusive) to end
+       (exclusive). Only the directories of these users are listed.'''
+    first = None if start is None else start.strftime('%Y-%m')
+    last = None if end is None else (
+        end - pd.Timedelta(microseconds=1)).strftime('%Y-%m')
+    if user_ids is None:
+        try:
+            users = [name for name in os.listdir(root())
+                     if name.startswith('user=')]
+        except FileNotFoundError:
+            return []
+    else:
+        users = [f'user={user_id}' for user_id in user_ids]
+    paths = []
+    for user in users:
+        try:
+            months = sorted(os.listdir(os.path.join(root(), user)))
+        except FileNotFoundError:
+            continue
+        for name in months:
+            month = name[len('month='):]
+            path = os.path.join(root(), user, name, FILE_NAME)
+            if (name.startswith('month=')
+                    and (first is None or month >= first)
+                    and (last is None or month <= last)
+                    and os.path.exists(path)):
+                paths.append(path)
+    return paths
+
+
+def dataset(paths):
+    '''Returns the partition files as a pyarrow dataset with user and month
+       partition columns, files are memory-mapped.'''
+    return ds.dataset(paths, format='ipc', partitioning=PARTITIONING,
+                      partition_base_dir=root(),
+                      schema=pa.unify_schemas([SCHEMA, PARTITIONING.schema]),
+                      filesystem=pafs.LocalFileSystem(use_mmap=True))
+
+
+def read_user(user_id, start=None, end=None):
+    '''Returns the datetimes and consumption of a user's readings from start
+       (inclusive) to end (exclusive), only the partitions of that user and
+       the months in the range are read.'''
+    table = dataset(partition_files([user_id], start, end)).to_table(
+        columns=['datetime', 'consumption'])
+    frame = table.to_pandas().sort_values('datetime', kind='stable')
+    if start is not None:
+        frame = frame[frame['datetime'] >= start]
+    if end is not None:
+        frame = frame[frame['datetime'] < end]
+    return frame['datetime'].values, frame['consumption'].values
+
+
+def read_users(user_ids, start=None, end=None):
+    '''Returns the user_data_id, datetime and consumption of the readings of
+       the users from start (inclusive) to end (exclusive) in user and
+       datetime order, only the partitions of these users and the months in
+       the range are read.'''
+    frame = (dataset(partition_files(user_ids, start, end))
+             .to_table(columns=['user', 'datetime', 'consumption'])
+             .to_pandas()
+             .rename(columns={'user': 'user_data_id'})
+             .sort_values(['user_data_id', 'datetime'], kind='stable'))
+    if start is not None:
+        frame = frame[frame['datetime'] >= start]
+    if end is not None:
+        frame = frame[frame['datetime'] < end]
+    return frame.reset_index(drop=True)
+
+
+def archived_readings(user_ids, size=ARCHIVE_USERS):
+    '''Yields the archived readings of the users like read_users, size
+       users at a time, nothing when nothing was archived.'''
+    boundary = archived_before()
+    if boundary is None:
+        return
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), size):
+        frame = read_users(user_ids[start:start + size], end=boundary)
+        if not frame.empty:
+            yield frame
+
+
+def user_month_stats(user_ids=None, start=None, end=None):
+    '''Returns count, sum and sum of squares of the readings per user and
+       month. Only the consumption column is read, user and month come from
+       the partition paths.'''
+    table = dataset(partition_files(user_ids, start, end)).to_table(
+        columns=['user', 'month', 'consumption'])
+    table = table.append_column(
+        'consumption_sq', pc.multiply(table['consumption'],
+                                      table['consumption']))
+    stats = table.group_by(['user', 'month']).aggregate(
+        [('consumption', 'count'), ('consumption', 'sum'),
+         ('consumption_sq', 'sum')]).to_pandas()
+    return (stats.rename(columns={'user': 'user_data_id',
+                                  'consumption_count': 'count',
+                                  'consumption_sum': 'total',
+                                  'consumption_sq_sum': 'total_sq'})
+            .sort_values(['user_data_id', 'month'])
+            .reset_index(drop=True))
@@ -0,0 +1,23 @@
+'''Tuning of the db connections of the production profile. Every new sqlite
+   connection gets the pragmas of the CONSUMPTION_SQLITE_PRAGMAS setting,
+   most importantly journal_mode=WAL: readers then see the last committed
+   data while the import writes, instead of waiting for its transactions,
+   and synchronous=NORMAL only syncs the WAL at checkpoints, which is safe
+   against corruption in WAL mode.'''
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+def apply_pragmas(sender=None, connection=None, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.CONSUMPTION_SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+def install():
+    '''Applies the pragmas to the connections created from now on.'''
+    connection_created.connect(apply_pragmas,
+                               dispatch_uid='consumption_sqlite_pragmas')
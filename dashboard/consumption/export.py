@@ -0,0 +1,64 @@
+'''Writers turning (user_data_id, datetime, consumption) rows into chunks of
+   csv or ndjson text for streaming responses.'''
+
+import csv
+import json
+from itertools import islice
+from asgiref.sync import sync_to_async
+
+EXPORT_CHUNK_SIZE = 2000
+HEADER = ['user_data_id', 'datetime', 'consumption']
+
+
+class Echo(object):
+    '''File-like object which returns what is written to it, so csv.writer
+       can format rows without buffering them.'''
+
+    def write(self, value):
+        return value
+
+
+def chunks(rows, size):
+    '''Yields lists of at most size rows.'''
+    rows = iter(rows)
+    chunk = list(islice(rows, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(rows, size))
+
+
+def csv_rows(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    '''Yields the csv header followed by the rows, chunk_size rows at a
+       time.'''
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+    for chunk in chunks(rows, chunk_size):
+        yield ''.join(writer.writerow(row) for row in chunk)
+
+
+def ndjson_rows(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    '''Yields one json object per row and line, chunk_size rows at a
+       time.'''
+    for chunk in chunks(rows, chunk_size):
+        yield ''.join(json.dumps(dict(zip(HEADER, (user_data_id,
+                                                   str(datetime),
+                                                   consumption)))) + '\n'
+                      for user_data_id, datetime, consumption in chunk)
+
+
+async def in_sync_thread(chunks):
+    '''Iterates a generator of chunks one chunk at a time in the thread of
+       the sync code, so a streaming response served by ASGI neither
+       queries the db in the event loop nor is buffered whole.'''
+    chunks = iter(chunks)
+    next_chunk = sync_to_async(next)
+    while True:
+        chunk = await next_chunk(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+EXPORT_FORMATS = {'csv': csv_rows, 'ndjson': ndjson_rows}
+EXPORT_CONTENT_TYPES = {'csv': 'text/csv',
+                        'ndjson': 'application/x-ndjson'}
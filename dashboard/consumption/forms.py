@@ -1,6 +1,104 @@
 # -*- coding: utf-8 -*-
+import datetime
 from django import forms
+from consumption.models import User_data
+from consumption.series import RESOLUTIONS, MAX_POINTS
+
+MAX_USERS = 100
 
 
 class Search(forms.Form):
-    id_search = forms.IntegerField(min_value=3000, max_value=3078, label='')
+    '''User id of the detail pages, users which are not in the db are
+       reported by the views.'''
+    id_search = forms.IntegerField(min_value=1, label='')
+
+
+class CursorField(forms.Field):
+    '''The id of a reading or, for an archived reading which has no id, its
+       datetime.'''
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if value.isdigit() and int(value) > 0:
+            return int(value)
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except ValueError:
+            raise forms.ValidationError('Enter a reading id or datetime.')
+
+
+class Page(forms.Form):
+    '''Keyset cursors of the detail table, the last row of the previous
+       page or the first row of the next page.'''
+    after = CursorField(required=False)
+    before = CursorField(required=False)
+
+
+class Range(forms.Form):
+    '''Time range, resolution and maximum number of points of the detail
+       graph.'''
+    start = forms.DateTimeField(required=False)
+    end = forms.DateTimeField(required=False)
+    resolution = forms.ChoiceField(
+        choices=[(resolution, resolution) for resolution in RESOLUTIONS],
+        required=False)
+    points = forms.IntegerField(min_value=3, max_value=MAX_POINTS,
+                                required=False)
+
+
+class Selection(forms.Form):
+    '''Users selected by comma separated ids, area and tariff and a time
+       range, all optional.'''
+    ids = forms.CharField(required=False)
+    area = forms.CharField(max_length=50, required=False)
+    tariff = forms.CharField(max_length=50, required=False)
+    start = forms.DateTimeField(required=False)
+    end = forms.DateTimeField(required=False)
+
+    def clean_ids(self):
+        try:
+            ids = sorted({int(user_id) for user_id in
+                          self.cleaned_data['ids'].split(',') if user_id})
+        except ValueError:
+            raise forms.ValidationError('ids must be comma separated'
+                                        ' integers.')
+        if len(ids) > MAX_USERS:
+            raise forms.ValidationError(f'At most {MAX_USERS} ids can be'
+                                        ' selected.')
+        return ids
+
+
+class Compare(Selection):
+    '''Users to compare, by id and/or area and tariff, with the time range
+       and resolution of their series. At most MAX_USERS users can be
+       selected, which is checked on the users the selection resolves to.'''
+    resolution = forms.ChoiceField(
+        choices=[(resolution, resolution) for resolution in RESOLUTIONS
+                 if resolution != 'raw'],
+        required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not (cleaned_data.get('ids') or cleaned_data.get('area') or
+                cleaned_data.get('tariff')):
+            raise forms.ValidationError('Select users by ids, area or'
+                                        ' tariff.')
+        users = User_data.objects.all()
+        if cleaned_data.get('ids'):
+            users = users.filter(id__in=cleaned_data['ids'])
+        if cleaned_data.get('area'):
+            users = users.filter(area=cleaned_data['area'])
+        if cleaned_data.get('tariff'):
+            users = users.filter(tariff=cleaned_data['tariff'])
+        if users.count() > MAX_USERS:
+            raise forms.ValidationError(f'At most {MAX_USERS} users can be'
+                                        ' selected, narrow the selection'
+                                        ' down by ids, area or tariff.')
+        return cleaned_data
+
+
+class Anomalies(Selection):
+    '''Users and time range whose anomalous days are listed, days whose
+       z-score is at least z in either direction.'''
+    z = forms.FloatField(min_value=0, required=False)
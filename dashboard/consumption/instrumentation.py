@@ -0,0 +1,198 @@
+'''Opt-in per request instrumentation of the consumption views, enabled by
+   the CONSUMPTION_INSTRUMENTATION setting. While a request is recorded the
+   queries of every db connection are counted and timed, the code wrapped
+   in stage() is timed under the stage's name and, with
+   CONSUMPTION_INSTRUMENTATION_MEMORY also set, the peak of the memory
+   allocated by Python and NumPy is traced. The middleware reports them in
+   a Server-Timing header and adds them to per view metrics, served in the
+   Prometheus text format by the metrics view.
+
+   The record of a request is held in a context variable, so it follows
+   the request into sync_to_async and the API pool. Peak memory is traced
+   process wide with tracemalloc, which covers concurrent requests too and
+   slows allocation heavy code down several times. SQL time is the time
+   spent executing queries, fetching their rows counts towards the stage
+   around the code iterating them.'''
+
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+DURATION_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                    10]
+
+_record = ContextVar('consumption_record', default=None)
+
+
+class Record(object):
+    '''Measurements of one request.'''
+
+    def __init__(self, trace_memory=False):
+        self.start = time.perf_counter()
+        self.duration = None
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.stages = {}
+        self.trace_memory = trace_memory
+        self.peak_memory = None
+        if trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self.base_memory = tracemalloc.get_traced_memory()[0]
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.start
+        if self.trace_memory:
+            self.peak_memory = max(tracemalloc.get_traced_memory()[1]
+                                   - self.base_memory, 0)
+
+    def server_timing(self):
+        '''Returns the value of the Server-Timing header.'''
+        metrics = [f'total;dur={self.duration * 1000:.1f}',
+                   f'sql;dur={self.sql_seconds * 1000:.1f};'
+                   f'desc="{self.queries} queries"']
+        metrics += [f'{name};dur={seconds * 1000:.1f}'
+                    for name, seconds in self.stages.items()]
+        if self.peak_memory is not None:
+            metrics.append(
+                f'mem;desc="peak {self.peak_memory / 2 ** 20:.1f}MB"')
+        return ', '.join(metrics)
+
+
+def begin(trace_memory=False):
+    '''Starts recording the current request and returns its record and the
+       token to end it with.'''
+    record = Record(trace_memory)
+    return record, _record.set(record)
+
+
+def end(record, token):
+    record.finish()
+    _record.reset(token)
+
+
+@contextmanager
+def stage(name):
+    '''Times the wrapped code as the named stage of the recorded request,
+       does nothing when no request is recorded.'''
+    record = _record.get()
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.stages[name] = (record.stages.get(name, 0.0)
+                               + time.perf_counter() - start)
+
+
+def sql_wrapper(execute, sql, params, many, context):
+    '''Execute wrapper counting and timing the queries of the recorded
+       request.'''
+    record = _record.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record.queries += 1
+        record.sql_seconds += time.perf_counter() - start
+
+
+def add_sql_wrapper(sender=None, connection=None, **kwargs):
+    if sql_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(sql_wrapper)
+
+
+def install():
+    '''Wraps the db connections of this thread and those created later.'''
+    connection_created.connect(add_sql_wrapper,
+                               dispatch_uid='consumption_sql_wrapper')
+    for connection in connections.all():
+        add_sql_wrapper(connection=connection)
+
+
+class Metrics(object):
+    '''Counters and request duration histograms per view.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def observe(self, view, record):
+        with self.lock:
+            metrics = self.views.setdefault(view, {
+                'requests': 0, 'seconds': 0.0,
+                'buckets': [0] * len(DURATION_BUCKETS), 'queries': 0,
+                'sql_seconds': 0.0, 'stages': {}, 'peak_memory': None})
+            metrics['requests'] += 1
+            metrics['seconds'] += record.duration
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if record.duration <= bound:
+                    metrics['buckets'][i] += 1
+            metrics['queries'] += record.queries
+            metrics['sql_seconds'] += record.sql_seconds
+            for name, seconds in record.stages.items():
+                metrics['stages'][name] = (metrics['stages'].get(name, 0.0)
+                                           + seconds)
+            if record.peak_memory is not None:
+                metrics['peak_memory'] = max(metrics['peak_memory'] or 0,
+                                             record.peak_memory)
+
+    def render(self):
+        '''Returns the metrics in the Prometheus text format.'''
+        lines = []
+
+        def family(name, kind, help_text, samples):
+            lines.extend([f'# HELP {name} {help_text}',
+                          f'# TYPE {name} {kind}'])
+            lines.extend(f'{name}{labels} {value}'
+                         for labels, value in samples)
+
+        with self.lock:
+            views = sorted(self.views.items())
+            family('consumption_requests_total', 'counter',
+                   'Recorded requests per view.',
+                   [(f'{{view="{view}"}}', metrics['requests'])
+                    for view, metrics in views])
+            samples = []
+            for view, metrics in views:
+                samples += [(f'_bucket{{view="{view}",le="{bound}"}}',
+                             count) for bound, count in
+                            zip(DURATION_BUCKETS, metrics['buckets'])]
+                samples += [(f'_bucket{{view="{view}",le="+Inf"}}',
+                             metrics['requests']),
+                            (f'_sum{{view="{view}"}}', metrics['seconds']),
+                            (f'_count{{view="{view}"}}',
+                             metrics['requests'])]
+            family('consumption_request_duration_seconds', 'histogram',
+                   'Request duration per view.', samples)
+            family('consumption_sql_queries_total', 'counter',
+                   'SQL queries per view.',
+                   [(f'{{view="{view}"}}', metrics['queries'])
+                    for view, metrics in views])
+            family('consumption_sql_duration_seconds_total', 'counter',
+                   'Time spent in SQL queries per view.',
+                   [(f'{{view="{view}"}}', metrics['sql_seconds'])
+                    for view, metrics in views])
+            family('consumption_stage_duration_seconds_total', 'counter',
+                   'Time spent in named stages per view.',
+                   [(f'{{view="{view}",stage="{name}"}}', seconds)
+                    for view, metrics in views
+                    for name, seconds in sorted(metrics['stages'].items())])
+            family('consumption_request_peak_memory_bytes', 'gauge',
+                   'Largest peak of traced memory of a request per view.',
+                   [(f'{{view="{view}"}}', metrics['peak_memory'])
+                    for view, metrics in views
+                    if metrics['peak_memory'] is not None])
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,101 @@
+'''Bulk loaders used by the import command to write consumption DataFrames to
+   the db. The native loaders write tuples straight from the DataFrame columns
+   instead of building a Consumption instance for every row.'''
+
+import io
+from django.db import connection
+from consumption.models import Consumption
+
+COLUMNS = ['user_data_id', 'datetime', 'consumption']
+
+
+class OrmLoader(object):
+    '''Writes batches with bulk_create, works on every db backend.'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def load(self, batch):
+        Consumption.objects.bulk_create([
+            Consumption(user_data_id=user_data_id, datetime=datetime,
+                        consumption=consumption)
+            for user_data_id, datetime, consumption in zip(
+                batch['user_data_id'].tolist(),
+                batch['datetime'].dt.to_pydatetime(),
+                batch['consumption'].tolist())])
+
+
+class SqliteLoader(OrmLoader):
+    '''Writes batches with a single executemany. While the loader is open the
+       connection runs with pragmas tuned for bulk inserts, the previous
+       values are restored on exit. sqlite does not allow changing them
+       inside a transaction, so they are left alone when the loader is
+       opened in one.'''
+
+    PRAGMAS = {'synchronous': 'OFF', 'cache_size': '-65536',
+               'temp_store': 'MEMORY'}
+
+    def __init__(self):
+        table = connection.ops.quote_name(Consumption._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(column)
+                            for column in COLUMNS)
+        self.sql = (f'INSERT INTO {table} ({columns})'
+                    f' VALUES ({", ".join(["%s"] * len(COLUMNS))})')
+        self.previous = {}
+
+    def __enter__(self):
+        if connection.in_atomic_block:
+            return self
+        with connection.cursor() as cursor:
+            for pragma, value in self.PRAGMAS.items():
+                cursor.execute(f'PRAGMA {pragma}')
+                self.previous[pragma] = cursor.fetchone()[0]
+                cursor.execute(f'PRAGMA {pragma} = {value}')
+        return self
+
+    def __exit__(self, *exc_info):
+        with connection.cursor() as cursor:
+            for pragma, value in self.previous.items():
+                cursor.execute(f'PRAGMA {pragma} = {value}')
+        return False
+
+    def load(self, batch):
+        rows = zip(batch['user_data_id'].tolist(),
+                   batch['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
+                   .tolist(),
+                   # same text format django uses for naive datetimes, str()
+                   # drops the time when a whole batch is at midnight
+                   batch['consumption'].tolist())
+        with connection.cursor() as cursor:
+            cursor.executemany(self.sql, rows)
+
+
+class PostgresLoader(OrmLoader):
+    '''Streams batches to the table with COPY FROM STDIN.'''
+
+    def __init__(self):
+        table = connection.ops.quote_name(Consumption._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(column)
+                            for column in COLUMNS)
+        self.sql = f'COPY {table} ({columns}) FROM STDIN WITH CSV'
+
+    def load(self, batch):
+        buffer = io.StringIO()
+        batch[COLUMNS].to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(self.sql, buffer)
+
+
+LOADERS = {'sqlite': SqliteLoader, 'postgresql': PostgresLoader}
+
+
+def get_loader(name='native'):
+    '''Returns the loader for the current db backend, the ORM loader is used
+       when name is "orm" or the backend has no native loader.'''
+    if name == 'orm':
+        return OrmLoader()
+    return LOADERS.get(connection.vendor, OrmLoader)()
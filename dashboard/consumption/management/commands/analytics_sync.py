@@ -0,0 +1,74 @@
+'''Running this script rebuilds the daily peaks and anomaly scores of every
+   user from the consumption table and the months archived in the columnar
+   store, e.g. for data imported before they were maintained by the
+   import.'''
+
+import logging
+import pandas as pd
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import CharField
+from django.db.models.functions import Cast
+from consumption import columnar
+from consumption.analytics import update_peaks, update_scores, first_days
+from consumption.cache import bump_data_version
+from consumption.models import User_data, Consumption, User_day_analytics
+
+CHUNK_SIZE = 100000
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Number of readings reduced to daily peaks'
+                                 ' at a time.')
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - '
+                            '%(filename)s - %(levelname)s - %(message)s')
+        logger = logging.getLogger(__name__)
+        boundary = columnar.archived_before()
+        readings = Consumption.objects.order_by('user_data_id', 'datetime')
+        if boundary is not None:
+            readings = readings.filter(datetime__gte=boundary)
+        readings = (readings.annotate(text=Cast('datetime', CharField()))
+                    .values_list('user_data_id', 'text', 'consumption')
+                    .iterator(chunk_size=options['chunk_size']))
+        # datetimes are fetched as text and parsed per chunk by pandas
+        since = {}
+        with transaction.atomic():
+            User_day_analytics.objects.all().delete()
+            for batch in columnar.archived_readings(
+                    User_data.objects.values_list('id', flat=True)):
+                self.add_peaks(batch, since)
+            # the archived months come first, before the boundary
+            chunk = []
+            for reading in readings:
+                chunk.append(reading)
+                if len(chunk) == options['chunk_size']:
+                    self.add_chunk(chunk, since)
+                    chunk = []
+            if chunk:
+                self.add_chunk(chunk, since)
+            update_scores(since)
+        bump_data_version()
+        logger.info(f'Analytics rebuilt for {len(since)} users')
+
+    def add_chunk(self, chunk, since):
+        '''Adds the peaks of a chunk of readings fetched from the
+           consumption table.'''
+        batch = pd.DataFrame(chunk, columns=['user_data_id', 'datetime',
+                                             'consumption'])
+        batch['datetime'] = pd.to_datetime(batch['datetime'],
+                                           format='ISO8601')
+        self.add_peaks(batch, since)
+
+    def add_peaks(self, batch, since):
+        '''Merges the daily peaks of a batch of readings of any number of
+           users and adds the first day of the users new in since.'''
+        update_peaks(batch)
+        for user_id, day in first_days(batch).items():
+            since.setdefault(user_id, day)
+        # readings come in order, the first batch of a user has its first
+        # day
@@ -0,0 +1,33 @@
+'''Running this script rebuilds the array store of every user from the
+   columnar store when it is enabled, otherwise from the consumption
+   table.'''
+
+import logging
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from consumption import arrays, columnar
+from consumption.models import User_data, Consumption
+
+
+class Command(BaseCommand):
+
+    def handle(self, *args, **options):
+        if not arrays.enabled():
+            raise CommandError('Set CONSUMPTION_ARRAY_DIR to use the array'
+                               ' store.')
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - '
+                            '%(filename)s - %(levelname)s - %(message)s')
+        logger = logging.getLogger(__name__)
+        user_ids = User_data.objects.order_by('id').values_list('id',
+                                                                flat=True)
+        for user_id in user_ids:
+            if columnar.enabled():
+                datetimes, consumption = columnar.read_user(user_id)
+            else:
+                data = list(Consumption.objects.filter(user_data_id=user_id)
+                            .values_list('datetime', 'consumption'))
+                datetimes = np.array([row[0] for row in data],
+                                     arrays.DATETIME_DTYPE)
+                consumption = np.array([row[1] for row in data])
+            arrays.write_user(user_id, datetimes, consumption)
+        logger.info(f'Array store rebuilt for {len(user_ids)} users')
@@ -0,0 +1,97 @@
+'''Running this script backfills the columnar store from the consumption table
+   and optionally archives old months out of the table.'''
+
+import logging
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from consumption import columnar
+from consumption.models import Consumption, User_month_rollup
+
+
+class Syncer(object):
+
+    def __init__(self):
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - '
+                            '%(filename)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+
+    def mismatched_months(self):
+        '''Returns (user id, month) of the partitions whose reading count
+           differs from the user_month_rollup table, which counts every
+           imported reading including the archived ones.'''
+        expected = pd.DataFrame(
+            list(User_month_rollup.objects
+                 .values_list('user_data_id', 'month', 'count')),
+            columns=['user_data_id', 'month', 'count'])
+        expected['month'] = pd.to_datetime(
+            expected['month']).dt.strftime('%Y-%m')
+        stored = columnar.user_month_stats()[['user_data_id', 'month',
+                                              'count']]
+        counts = expected.merge(stored, on=['user_data_id', 'month'],
+                                how='outer', suffixes=('', '_stored'))
+        counts = counts.fillna(0)
+        return [(int(user_id), month) for user_id, month in
+                counts.loc[counts['count'] != counts['count_stored'],
+                           ['user_data_id', 'month']].values]
+
+    def sync(self):
+        '''Rewrites the partitions which do not match the db from the
+           consumption table. Months which were already archived can not be
+           rewritten and are reported.'''
+        rewritten = 0
+        for user_id, month in self.mismatched_months():
+            start = pd.Timestamp(month)
+            readings = pd.DataFrame(
+                list(Consumption.objects
+                     .filter(user_data_id=user_id, datetime__gte=start,
+                             datetime__lt=start + pd.DateOffset(months=1))
+                     .values_list('datetime', 'consumption')),
+                columns=['datetime', 'consumption'])
+            if readings.empty:
+                self.logger.error(f'No readings of user {user_id} in'
+                                  f' {month} left in the db to rewrite the'
+                                  ' partition from')
+                continue
+            readings['datetime'] = pd.to_datetime(readings['datetime'])
+            columnar.write_partition(user_id, month, readings, append=False)
+            rewritten += 1
+        self.logger.info(f'Columnar store synced: {rewritten} partitions'
+                         ' rewritten')
+        return rewritten
+
+    def archive(self, before):
+        '''Deletes the readings of the months before the month of before
+           from the consumption table. Only done when every partition
+           matches the db, user metadata and rollups are kept. The month is
+           recorded in the store so the views read the archived months from
+           it.'''
+        if self.mismatched_months():
+            raise CommandError('The columnar store does not match the db,'
+                               ' nothing is archived.')
+        month = pd.Timestamp(before).to_period('M').to_timestamp()
+        with transaction.atomic():
+            columnar.set_archived_before(month.to_pydatetime())
+            deleted, _ = Consumption.objects.filter(
+                datetime__lt=month.to_pydatetime()).delete()
+        self.logger.info(f'Archived {deleted} readings before'
+                         f' {month:%Y-%m}')
+        return deleted
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archive-before', metavar='DATE',
+                            help='Delete the readings of the months before'
+                                 ' DATE from the db once they are in the'
+                                 ' columnar store.')
+
+    def handle(self, *args, **options):
+        if not columnar.enabled():
+            raise CommandError('Set CONSUMPTION_COLUMNAR_DIR to use the'
+                               ' columnar store.')
+        s = Syncer()
+        s.sync()
+        if options['archive_before']:
+            s.archive(options['archive_before'])
@@ -0,0 +1,26 @@
+'''Running this script recomputes the cost of every rollup row from the
+   consumption table and the months archived in the columnar store with the
+   current tariff schedules, e.g. after the schedules changed.'''
+
+import logging
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from consumption.cache import bump_data_version
+from consumption.tariffs import reprice, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Number of readings priced at a time.')
+
+    def handle(self, *args, **options):
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - '
+                            '%(filename)s - %(levelname)s - %(message)s')
+        logger = logging.getLogger(__name__)
+        days = reprice(apps, options['chunk_size'])
+        if not days:
+            return
+        bump_data_version()
+        logger.info(f'Costs recomputed for {days} user days')
@@ -2,19 +2,53 @@
    the sqlite db.'''
 
 import os
+import hashlib
 import logging
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import pandas as pd
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
 from django.db.utils import IntegrityError
-from consumption.models import User_data, Consumption
+from consumption.models import User_data, Consumption, Imported_file
+from consumption.parsing import read_consumption_file
+from consumption.loaders import get_loader
+from consumption.rollups import update_rollups
+from consumption.analytics import update_peaks, update_scores, first_days
+from consumption.cache import bump_data_version
+from consumption.management.commands.warm_cache import Warmer
+from consumption import arrays, columnar
+
+BATCH_SIZE = 10000
+DATA_DIR = os.path.join(os.path.dirname(__file__), '../../../../', 'data')
+STORES = [(columnar, columnar.write_batch, 'columnar_sync'),
+          (arrays, arrays.append_batch, 'array_sync')]
+
+
+def file_checksum(file_path):
+    '''Returns the sha1 hex digest of a file, read in 1MB blocks.'''
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
 
 
 class Importer(object):
 
-    def __init__(self):
+    def __init__(self, batch_size=BATCH_SIZE, workers=1, incremental=False,
+                 loader='native'):
         logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - '
                             '%(filename)s - %(levelname)s - %(message)s')
         self.logger = logging.getLogger(__name__)
+        self.batch_size = batch_size
+        self.workers = workers
+        self.incremental = incremental
+        self.loader = loader
+        self.failed_files = []
+        self.manifest = []
+        self.first_days = {}
 
     def import_user_data(self, user_data):
         '''This method imports user data to the user_data table in the
@@ -22,60 +56,266 @@ class Importer(object):
         try:
             user_data = pd.read_csv(user_data,
                                     encoding='utf-8').to_dict('records')
+            if self.incremental:
+                existing = set(User_data.objects.values_list('id',
+                                                             flat=True))
+                user_data = [row for row in user_data
+                             if row['id'] not in existing]
+                # only users which are not in the db yet are added
             user_data_table = [User_data(id=row['id'], area=row['area'],
                                          tariff=row['tariff'])
                                for row in user_data]
             User_data.objects.bulk_create(user_data_table)
-            self.logger.info('User data imported')
+            if user_data_table:
+                bump_data_version()
+            self.logger.info(f'User data imported: {len(user_data_table)}'
+                             ' users')
         except IntegrityError:
-            self.logger.info('user_data data already imported,'
-                             ' drop all rows in the table to import again.')
+            self.logger.error('user_data data already imported, run the'
+                              ' import with --incremental to only add new'
+                              ' users.')
         except Exception:
-            self.logger.info('Could not import user_data')
+            self.logger.exception('Could not import user_data')
         # importing user data
 
+    def consumption_files(self, consumption_dir):
+        '''Returns the paths of all consumption csv files in the directory,
+           sorted so imports are reproducible.'''
+        return [os.path.join(consumption_dir, file_name)
+                for file_name in sorted(os.listdir(consumption_dir))
+                if not file_name.startswith('.')]
+
+    def changed_files(self, file_paths):
+        '''Returns the files which are new or changed since the last import.
+           A file whose size and mtime match the manifest is skipped without
+           being read, otherwise its checksum decides. The checksum is only
+           computed by incremental imports, the others import every file and
+           record it without one. Manifest entries of changed files are kept
+           in self.manifest until the import succeeded.'''
+        known = {entry.file_name: entry
+                 for entry in Imported_file.objects.all()}
+        changed = []
+        for file_path in file_paths:
+            stat = os.stat(file_path)
+            file_name = os.path.basename(file_path)
+            entry = known.get(file_name, Imported_file(file_name=file_name))
+            if entry.size == stat.st_size and entry.mtime == stat.st_mtime:
+                continue
+            entry.size = stat.st_size
+            entry.mtime = stat.st_mtime
+            checksum = file_checksum(file_path) if self.incremental else ''
+            if checksum and entry.checksum == checksum:
+                entry.save()
+                # touched but unchanged, only the mtime is updated
+                continue
+            entry.checksum = checksum
+            self.manifest.append((file_path, entry))
+            changed.append(file_path)
+        return changed
+
+    def high_water_marks(self):
+        '''Returns the datetime of the latest reading of each user.'''
+        return dict(Consumption.objects.values_list('user_data_id')
+                    .order_by('user_data_id')
+                    .annotate(Max('datetime')))
+
+    def new_readings(self, frames):
+        '''Drops the readings of each DataFrame which are not newer than the
+           latest reading of that user in the db.'''
+        marks = self.high_water_marks()
+        for df in frames:
+            if df.empty:
+                continue
+            mark = marks.get(int(df['user_data_id'].iat[0]))
+            if mark is not None:
+                df = df[df['datetime'] > mark]
+            if not df.empty:
+                yield df
+
+    def save_manifest(self):
+        '''Records the files of this import in the manifest, files which
+           could not be read are left out so they are retried next time.'''
+        with transaction.atomic():
+            for file_path, entry in self.manifest:
+                if file_path not in self.failed_files:
+                    entry.save()
+        self.manifest = []
+
+    def parse_consumption_files(self, file_paths):
+        '''Yields (file path, DataFrame, error) for every file. With more
+           than one worker the files are parsed in a process pool, at most
+           two files per worker are in flight so parsed DataFrames can not
+           pile up faster than the database writer consumes them.'''
+        if self.workers <= 1:
+            for file_path in file_paths:
+                try:
+                    yield file_path, read_consumption_file(file_path), None
+                except Exception as error:
+                    yield file_path, None, error
+            return
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            file_paths = iter(file_paths)
+            pending = {executor.submit(read_consumption_file, file_path):
+                       file_path for file_path in
+                       islice(file_paths, self.workers * 2)}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    file_path = pending.pop(future)
+                    for next_path in islice(file_paths, 1):
+                        pending[executor.submit(read_consumption_file,
+                                                next_path)] = next_path
+                    error = future.exception()
+                    yield (file_path, None if error else future.result(),
+                           error)
+
+    def read_consumption_files(self, file_paths):
+        '''Yields one DataFrame per consumption file, progress is logged and
+           files which can not be parsed are logged and skipped.'''
+        total = len(file_paths)
+        step = max(total // 10, 1)
+        for parsed, (file_path, df, error) in enumerate(
+                self.parse_consumption_files(file_paths), 1):
+            if error is not None:
+                self.failed_files.append(file_path)
+                self.logger.error(f'Could not read {file_path}: {error!r}')
+            else:
+                yield df
+            if parsed % step == 0 or parsed == total:
+                self.logger.info(f'Parsed {parsed}/{total} consumption'
+                                 ' files')
+
+    def consumption_batches(self, frames):
+        '''Regroups the per file DataFrames into batches of at most
+           batch_size rows, only one batch and one file are held in memory
+           at a time.'''
+        pending = []
+        pending_rows = 0
+        for df in frames:
+            pending.append(df)
+            pending_rows += len(df)
+            while pending_rows >= self.batch_size:
+                df = pd.concat(pending, ignore_index=True)
+                yield df.iloc[:self.batch_size]
+                pending = [df.iloc[self.batch_size:]]
+                pending_rows = len(pending[0])
+        if pending_rows:
+            yield pd.concat(pending, ignore_index=True)
+
+    def write_consumption_batch(self, loader, batch):
+        '''Writes one batch to the consumption table and adds it to the
+           rollup tables and the daily peaks in its own transaction. The
+           batch is added to the enabled file stores once the transaction
+           committed, a failure there is logged and repaired by the store's
+           sync command.'''
+        with transaction.atomic():
+            loader.load(batch)
+            update_rollups(batch)
+            update_peaks(batch)
+        for user_id, day in first_days(batch).items():
+            self.first_days[user_id] = min(self.first_days.get(user_id, day),
+                                           day)
+        for store, write, command in STORES:
+            if not store.enabled():
+                continue
+            try:
+                write(batch)
+            except Exception:
+                self.logger.exception('Could not write consumption batch to'
+                                      f' {store.__name__}, run {command} to'
+                                      ' repair it')
+
     def import_consumption_data(self, consumption_dir):
         '''This method imports consumption data to the consumption table in the
-           sqlite db.'''
-        df_list = []
-        for file_name in os.listdir(consumption_dir):
-            if not file_name.startswith('.'):
-                df = pd.read_csv(consumption_dir + file_name,
-                                 encoding='utf-8')
-                df['user_data_id'] = int(os.path.splitext(file_name)[0])
-                # adding id to consumption file before importing
-                df.datetime = pd.to_datetime(df.datetime)
-                df_list.append(df[['user_data_id', 'datetime',
-                                   'consumption']])
-
-        try:
-            consumption_data = pd.concat(df_list).to_dict('records')
-
-            consumption_data_table = [
-                Consumption(
-                    user_data_id=row['user_data_id'],
-                    datetime=row['datetime'],
-                    consumption=row['consumption'])
-                for row in consumption_data]
-            Consumption.objects.bulk_create(consumption_data_table)
-            self.logger.info('Consumption data imported')
-        except IntegrityError:
-            self.logger.info('consumption table data already imported,'
-                             ' drop all rows in the table import again.')
-        except Exception:
-            self.logger.info('Could not import consumption_data')
+           sqlite db. Files are streamed in batches of batch_size rows, a
+           batch which fails is rolled back without affecting the others.'''
+        imported = 0
+        failed = 0
+        file_paths = self.consumption_files(consumption_dir)
+        changed = self.changed_files(file_paths)
+        if self.incremental:
+            self.logger.info(f'{len(file_paths) - len(changed)} of'
+                             f' {len(file_paths)} consumption files'
+                             ' unchanged, skipping them')
+            file_paths = changed
+        frames = self.read_consumption_files(file_paths)
+        if self.incremental:
+            frames = self.new_readings(frames)
+        with get_loader(self.loader) as loader:
+            for batch in self.consumption_batches(frames):
+                try:
+                    self.write_consumption_batch(loader, batch)
+                    imported += len(batch)
+                    self.logger.debug(f'{imported} consumption rows'
+                                      ' imported')
+                except IntegrityError:
+                    failed += len(batch)
+                    self.logger.error('consumption batch already imported,'
+                                      ' run the import with --incremental to'
+                                      ' only add new readings.')
+                except Exception:
+                    failed += len(batch)
+                    self.logger.exception('Could not import consumption'
+                                          ' batch')
+        self.logger.info(f'Consumption data imported: {imported} rows,'
+                         f' {failed} rows failed')
+        if self.failed_files:
+            self.logger.error(f'{len(self.failed_files)} consumption files'
+                              ' could not be read: '
+                              + ', '.join(self.failed_files))
+        if not failed:
+            self.save_manifest()
+        if imported:
+            try:
+                update_scores(self.first_days)
+                # anomalies of the days with new readings
+            except Exception:
+                self.logger.exception('Could not update the anomaly scores,'
+                                      ' run analytics_sync to repair them')
+            self.first_days = {}
+            bump_data_version()
+            # cached pages of the previous data are no longer served
         # importing consumption data
+        return imported
 
 
 class Command(BaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Number of consumption rows written per'
+                                 ' transaction.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of processes used to parse the'
+                                 ' consumption files.')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only import new users, changed files and'
+                                 ' readings newer than the latest reading'
+                                 ' of each user.')
+        parser.add_argument('--loader', choices=['native', 'orm'],
+                            default='native',
+                            help='native writes with executemany on sqlite'
+                                 ' and COPY on postgresql, orm uses'
+                                 ' bulk_create.')
+        parser.add_argument('--data-dir', default=DATA_DIR,
+                            help='Directory with user_data.csv and the'
+                                 ' consumption directory, data/ of the'
+                                 ' repository by default.')
+        parser.add_argument('--warm-cache', action='store_true',
+                            help='Build the cached pages and json payloads'
+                                 ' of the imported data afterwards, like the'
+                                 ' warm_cache command.')
+
     def handle(self, *args, **options):
-        i = Importer()
+        i = Importer(batch_size=options['batch_size'],
+                     workers=options['workers'],
+                     incremental=options['incremental'],
+                     loader=options['loader'])
         i.logger.info("Initiate Import.")
-        i.import_user_data(os.path.join(os.path.dirname(__file__),
-                                        '../../../../', 'data',
+        i.import_user_data(os.path.join(options['data_dir'],
                                         'user_data.csv'))
-        i.import_consumption_data(os.path.join(os.path.dirname(__file__),
-                                               '../../../../', 'data',
+        i.import_consumption_data(os.path.join(options['data_dir'],
                                                'consumption/'))
         i.logger.info("Import complete.")
+        if options['warm_cache']:
+            Warmer().warm()
@@ -0,0 +1,85 @@
+'''Running this script builds every cached page and json payload of the
+   current data version, so no request after an import is a cache miss.'''
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from consumption.cache import cached
+from consumption.models import User_data
+from consumption.views import (summary_tables, summary_payload,
+                               detail_options, detail_payload)
+
+LOCAL_CACHES = ['django.core.cache.backends.locmem.LocMemCache',
+                'django.core.cache.backends.dummy.DummyCache']
+
+
+class Warmer(object):
+
+    def __init__(self, workers=4):
+        logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - '
+                            '%(filename)s - %(levelname)s - %(message)s')
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers
+
+    def artifacts(self):
+        '''Returns (name, endpoint, build, key parts) of every cached
+           artifact, with the keys the views use for a request without
+           parameters.'''
+        artifacts = [('summary tables', 'summary', summary_tables, []),
+                     ('summary json', 'summary_api', summary_payload, [])]
+        options = detail_options()
+        for user_id in User_data.objects.order_by('id').values_list(
+                'id', flat=True):
+            artifacts.append(
+                (f'detail json {user_id}', 'detail_search_api',
+                 lambda user_id=user_id: detail_payload(user_id, **options),
+                 [user_id] + list(options.values())))
+        return artifacts
+
+    def build(self, artifact):
+        '''Builds one artifact into the cache and returns its name and the
+           seconds it took. Each pool thread closes its connection when
+           done.'''
+        name, endpoint, build, key_parts = artifact
+        start = time.perf_counter()
+        try:
+            cached(endpoint, build, *key_parts)
+        finally:
+            if self.workers > 1:
+                connection.close()
+        return name, time.perf_counter() - start
+
+    def warm(self):
+        '''Builds all artifacts, in a pool of workers threads when workers
+           is more than one, and returns (name, seconds) of each.'''
+        if settings.CACHES['default']['BACKEND'] in LOCAL_CACHES:
+            self.logger.warning('The cache backend is local to this'
+                                ' process, the server will not see the'
+                                ' warmed entries. Configure a shared'
+                                ' backend with CACHE_BACKEND.')
+        start = time.perf_counter()
+        artifacts = self.artifacts()
+        if self.workers > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                timings = list(executor.map(self.build, artifacts))
+        else:
+            timings = [self.build(artifact) for artifact in artifacts]
+        for name, seconds in timings:
+            self.logger.info(f'Built {name} in {seconds * 1000:.1f}ms')
+        self.logger.info(f'Warmed {len(timings)} cache entries in'
+                         f' {time.perf_counter() - start:.2f}s')
+        return timings
+
+
+class Command(BaseCommand):
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of threads building the cache'
+                                 ' entries.')
+
+    def handle(self, *args, **options):
+        Warmer(workers=options['workers']).warm()
@@ -0,0 +1,93 @@
+'''Middleware of the consumption app.'''
+
+import re
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from consumption import instrumentation
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BROTLI_QUALITY = 5
+
+
+class InstrumentationMiddleware(object):
+    '''Records SQL, named stages and optionally peak memory of every
+       request to a consumption view, see consumption.instrumentation.
+       Removed from the middleware chain unless CONSUMPTION_INSTRUMENTATION
+       is set. Works in sync and async chains, like django's
+       MiddlewareMixin.'''
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.CONSUMPTION_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.trace_memory = settings.CONSUMPTION_INSTRUMENTATION_MEMORY
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        instrumentation.install()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        record, token = instrumentation.begin(self.trace_memory)
+        try:
+            response = self.get_response(request)
+        finally:
+            instrumentation.end(record, token)
+        return self.report(request, response, record)
+
+    async def __acall__(self, request):
+        record, token = instrumentation.begin(self.trace_memory)
+        try:
+            response = await self.get_response(request)
+        finally:
+            instrumentation.end(record, token)
+        return self.report(request, response, record)
+
+    def report(self, request, response, record):
+        '''Adds the Server-Timing header and the metrics of requests which
+           were resolved to a consumption view.'''
+        match = request.resolver_match
+        if match is None or not match.func.__module__.startswith(
+                'consumption.'):
+            return response
+        response['Server-Timing'] = record.server_timing()
+        instrumentation.metrics.observe(match.url_name or
+                                        match.func.__name__, record)
+        return response
+
+
+class CompressionMiddleware(GZipMiddleware):
+    '''django's GZipMiddleware, which compresses responses with brotli
+       instead when the client accepts it and the brotli package is
+       installed. Streaming responses are always gzipped.'''
+
+    def process_response(self, request, response):
+        if (brotli is None or response.streaming
+                or len(response.content) < 200
+                or response.has_header('Content-Encoding')
+                or not re.search(r'\bbr\b',
+                                 request.META.get('HTTP_ACCEPT_ENCODING',
+                                                  ''))):
+            return super().process_response(request, response)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed = brotli.compress(response.content,
+                                     quality=BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = 'br'
+        return response
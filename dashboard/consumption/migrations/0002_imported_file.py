@@ -0,0 +1,26 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Imported_file',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file_name', models.CharField(max_length=255, unique=True)),
+                ('size', models.BigIntegerField(null=True)),
+                ('mtime', models.FloatField(null=True)),
+                ('checksum', models.CharField(max_length=40)),
+            ],
+            options={
+                'db_table': 'imported_file',
+            },
+        ),
+    ]
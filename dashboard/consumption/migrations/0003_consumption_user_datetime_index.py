@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0002_imported_file'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='consumption',
+            name='user_data',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='consumption.User_data'),
+        ),
+        migrations.AddIndex(
+            model_name='consumption',
+            index=models.Index(fields=['user_data', 'datetime'], name='consumption_user_datetime'),
+        ),
+    ]
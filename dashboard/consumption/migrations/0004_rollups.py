@@ -0,0 +1,74 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0003_consumption_user_datetime_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tariff_month_rollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0)),
+                ('total_sq', models.FloatField(default=0)),
+                ('tariff', models.CharField(max_length=50)),
+                ('month', models.DateField()),
+            ],
+            options={
+                'db_table': 'tariff_month_rollup',
+                'unique_together': {('tariff', 'month')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Area_month_rollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0)),
+                ('total_sq', models.FloatField(default=0)),
+                ('area', models.CharField(max_length=50)),
+                ('month', models.DateField()),
+            ],
+            options={
+                'db_table': 'area_month_rollup',
+                'unique_together': {('area', 'month')},
+            },
+        ),
+        migrations.CreateModel(
+            name='User_month_rollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0)),
+                ('total_sq', models.FloatField(default=0)),
+                ('month', models.DateField()),
+                ('user_data', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='consumption.User_data')),
+            ],
+            options={
+                'db_table': 'user_month_rollup',
+                'unique_together': {('user_data', 'month')},
+            },
+        ),
+        migrations.CreateModel(
+            name='User_day_rollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0)),
+                ('total_sq', models.FloatField(default=0)),
+                ('date', models.DateField()),
+                ('user_data', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='consumption.User_data')),
+            ],
+            options={
+                'db_table': 'user_day_rollup',
+                'unique_together': {('user_data', 'date')},
+            },
+        ),
+    ]
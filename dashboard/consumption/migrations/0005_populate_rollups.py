@@ -0,0 +1,48 @@
+from django.db import migrations
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.expressions import ExpressionWrapper
+from django.db.models.functions import TruncDate, TruncMonth
+
+
+def populate_rollups(apps, schema_editor):
+    '''Builds the rollup tables from the readings which were imported before
+       the tables existed.'''
+    Consumption = apps.get_model('consumption', 'Consumption')
+    User_day_rollup = apps.get_model('consumption', 'User_day_rollup')
+    User_month_rollup = apps.get_model('consumption', 'User_month_rollup')
+    Area_month_rollup = apps.get_model('consumption', 'Area_month_rollup')
+    Tariff_month_rollup = apps.get_model('consumption',
+                                         'Tariff_month_rollup')
+    consumption_sq = ExpressionWrapper(F('consumption') * F('consumption'),
+                                       output_field=FloatField())
+    User_day_rollup.objects.bulk_create(
+        [User_day_rollup(**row) for row in
+         Consumption.objects.annotate(date=TruncDate('datetime'))
+         .values('user_data_id', 'date').order_by()
+         .annotate(count=Count('id'), total=Sum('consumption'),
+                   total_sq=Sum(consumption_sq))], batch_size=500)
+    User_month_rollup.objects.bulk_create(
+        [User_month_rollup(**row) for row in
+         User_day_rollup.objects.annotate(month=TruncMonth('date'))
+         .values('user_data_id', 'month').order_by()
+         .annotate(count=Sum('count'), total=Sum('total'),
+                   total_sq=Sum('total_sq'))], batch_size=500)
+    for model, key in [(Area_month_rollup, 'area'),
+                       (Tariff_month_rollup, 'tariff')]:
+        model.objects.bulk_create(
+            [model(**row) for row in
+             User_month_rollup.objects
+             .values('month', **{key: F(f'user_data__{key}')}).order_by()
+             .annotate(count=Sum('count'), total=Sum('total'),
+                       total_sq=Sum('total_sq'))], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0004_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
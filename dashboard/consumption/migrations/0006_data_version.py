@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:47
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0005_populate_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Data_version',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'data_version',
+            },
+        ),
+    ]
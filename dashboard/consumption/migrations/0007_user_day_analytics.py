@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0006_data_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='User_day_analytics',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('mean', models.FloatField(null=True)),
+                ('peak', models.FloatField()),
+                ('peak_time', models.TimeField()),
+                ('baseline', models.FloatField(null=True)),
+                ('spread', models.FloatField(null=True)),
+                ('z_score', models.FloatField(null=True)),
+                ('user_data', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='consumption.user_data')),
+            ],
+            options={
+                'db_table': 'user_day_analytics',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='user_day_analytics',
+            index=models.Index(fields=['date'], name='user_day_analytics_date'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='user_day_analytics',
+            unique_together={('user_data', 'date')},
+        ),
+    ]
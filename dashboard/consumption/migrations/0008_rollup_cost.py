@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0007_user_day_analytics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='area_month_rollup',
+            name='cost',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tariff_month_rollup',
+            name='cost',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user_day_rollup',
+            name='cost',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user_month_rollup',
+            name='cost',
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,128 @@
+from itertools import islice
+import numpy as np
+import pandas as pd
+from django.db import connection, migrations, models
+from django.db.models import CharField
+from django.db.models.functions import Cast
+
+# The schedules of CONSUMPTION_TARIFFS when the rollups got a cost, in rates
+# per kWh. They are frozen here so that this migration always prices the
+# same way, cost_sync reprices with the schedules of the settings.
+TARIFFS = {
+    't1': [('00:00', 0.20)],
+    't2': [('00:00', 0.10), ('07:00', 0.25)],
+    't3': [('00:00', 0.12), ('07:00', 0.22), ('16:00', 0.40),
+           ('19:00', 0.22)],
+}
+CHUNK_SIZE = 100000
+ROLLUPS = [('User_day_rollup', ['user_data_id', 'date']),
+           ('User_month_rollup', ['user_data_id', 'month']),
+           ('Area_month_rollup', ['area', 'month']),
+           ('Tariff_month_rollup', ['tariff', 'month'])]
+
+
+def rate_table():
+    '''Returns the rows of the tariffs in a table of 48 half hourly rates
+       per tariff followed by a row of NaN for tariffs without a schedule.'''
+    table = np.full((len(TARIFFS) + 1, 48), np.nan)
+    for row, bands in enumerate(TARIFFS.values()):
+        starts = [int(start[:2]) * 2 + int(start[3:]) // 30
+                  for start, _ in bands]
+        for (_, rate), start, end in zip(bands, starts, starts[1:] + [48]):
+            table[row, start:end] = rate
+    return pd.Index(list(TARIFFS)), table
+
+
+def set_costs(model, keys, frame):
+    '''Sets the cost of the rollup rows in frame, NaN for no cost.'''
+    table = connection.ops.quote_name(model._meta.db_table)
+    where = ' AND '.join(
+        f'{connection.ops.quote_name(model._meta.get_field(key).column)}'
+        ' = %s' for key in keys)
+    rows = frame[['cost'] + keys].copy()
+    for key in keys:
+        if key in ('date', 'month'):
+            rows[key] = rows[key].dt.strftime('%Y-%m-%d')
+    rows = rows.astype(object).where(rows.notna(), None)
+    with connection.cursor() as cursor:
+        cursor.executemany(f'UPDATE {table} SET cost = %s WHERE {where}',
+                           rows.values.tolist())
+
+
+def populate_costs(apps, schema_editor):
+    '''Prices the rollup rows of the readings which were imported before
+       the rollups had a cost, 0008 left them at 0. Rows without readings in
+       the consumption table, like the months archived to the columnar
+       store, are left without cost until cost_sync prices them.'''
+    User_data = apps.get_model('consumption', 'User_data')
+    Consumption = apps.get_model('consumption', 'Consumption')
+    for name, _ in ROLLUPS:
+        apps.get_model('consumption', name).objects.update(cost=None)
+    users = pd.DataFrame(list(User_data.objects.values_list('id', 'area',
+                                                            'tariff')),
+                         columns=['user_data_id', 'area', 'tariff'])
+    labels, table = rate_table()
+    rows = pd.Series(labels.get_indexer(users['tariff']),
+                     index=users['user_data_id'])
+    # -1 of unknown tariffs selects the last row, the NaN rates
+    readings = (Consumption.objects
+                .annotate(text=Cast('datetime', CharField()))
+                .values_list('user_data_id', 'text', 'consumption')
+                .iterator(chunk_size=CHUNK_SIZE))
+    days = []
+    chunk = list(islice(readings, CHUNK_SIZE))
+    while chunk:
+        frame = pd.DataFrame(chunk, columns=['user_data_id', 'datetime',
+                                             'consumption'])
+        datetimes = pd.to_datetime(frame['datetime'], format='ISO8601')
+        slots = (datetimes.dt.hour * 2 + datetimes.dt.minute // 30).values
+        frame['cost'] = (frame['consumption'].values / 1000
+                         * table[frame['user_data_id'].map(rows).values,
+                                 slots])
+        frame['date'] = datetimes.dt.normalize()
+        days.append(frame.groupby(['user_data_id', 'date'])['cost']
+                    .sum(min_count=1))
+        chunk = list(islice(readings, CHUNK_SIZE))
+    if not days:
+        return
+    days = (pd.concat(days).groupby(level=[0, 1]).sum(min_count=1)
+            .reset_index())
+    days['month'] = days['date'].dt.to_period('M').dt.to_timestamp()
+    months = (days.groupby(['user_data_id', 'month'])['cost']
+              .sum(min_count=1).reset_index().merge(users))
+    frames = [days, months] + [
+        months.groupby([key, 'month'])['cost'].sum(min_count=1)
+        .reset_index() for key in ['area', 'tariff']]
+    for (name, keys), frame in zip(ROLLUPS, frames):
+        set_costs(apps.get_model('consumption', name), keys, frame)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0008_rollup_cost'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='area_month_rollup',
+            name='cost',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='tariff_month_rollup',
+            name='cost',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='user_day_rollup',
+            name='cost',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='user_month_rollup',
+            name='cost',
+            field=models.FloatField(null=True),
+        ),
+        migrations.RunPython(populate_costs, migrations.RunPython.noop),
+    ]
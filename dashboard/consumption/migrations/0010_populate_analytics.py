@@ -0,0 +1,91 @@
+from itertools import islice
+import pandas as pd
+from django.db import migrations
+from django.db.models import CharField
+from django.db.models.functions import Cast
+
+# The baseline of consumption.analytics when the table was added, frozen
+# here so that this migration always scores the same way.
+WINDOW = 28
+MIN_DAYS = 7
+CHUNK_SIZE = 100000
+
+
+def daily_peaks(frame):
+    '''Returns the largest reading of every user and day of a chunk of
+       readings in datetime order, with the time it was first reached.'''
+    frame = frame.assign(date=frame['datetime'].dt.normalize())
+    return frame.loc[frame.groupby(['user_data_id', 'date'])['consumption']
+                     .idxmax().values]
+
+
+def populate_analytics(apps, schema_editor):
+    '''Builds the peaks and anomaly scores of the days of the readings which
+       were imported before the analytics table existed, the days imported
+       since already have their row. Months already
+       archived to the columnar store only get their rows from
+       analytics_sync, as their readings are not in the consumption
+       table.'''
+    Consumption = apps.get_model('consumption', 'Consumption')
+    User_day_rollup = apps.get_model('consumption', 'User_day_rollup')
+    User_day_analytics = apps.get_model('consumption', 'User_day_analytics')
+    readings = (Consumption.objects.order_by('user_data_id', 'datetime')
+                .annotate(text=Cast('datetime', CharField()))
+                .values_list('user_data_id', 'text', 'consumption')
+                .iterator(chunk_size=CHUNK_SIZE))
+    peaks = []
+    chunk = list(islice(readings, CHUNK_SIZE))
+    while chunk:
+        frame = pd.DataFrame(chunk, columns=['user_data_id', 'datetime',
+                                             'consumption'])
+        frame['datetime'] = pd.to_datetime(frame['datetime'],
+                                           format='ISO8601')
+        peaks.append(daily_peaks(frame))
+        chunk = list(islice(readings, CHUNK_SIZE))
+    if not peaks:
+        return
+    peaks = daily_peaks(pd.concat(peaks, ignore_index=True))
+    # a day split over two chunks keeps its first largest reading
+    rollups = pd.DataFrame(
+        list(User_day_rollup.objects.values_list('date', 'user_data_id',
+                                                 'count', 'total')),
+        columns=['date', 'user_data_id', 'count', 'total'])
+    rollups['mean'] = rollups['total'] / rollups['count']
+    means = (rollups.pivot(index='date', columns='user_data_id',
+                           values='mean')
+             .reindex(pd.date_range(rollups['date'].min(),
+                                    rollups['date'].max()).date)
+             .rename_axis('date'))
+    rolling = means.rolling(WINDOW, min_periods=MIN_DAYS)
+    baseline = rolling.mean().shift(1)
+    spread = rolling.std().shift(1)
+    z_score = (means - baseline) / spread.where(spread > 0)
+    scores = pd.concat({'mean': means.stack(), 'baseline': baseline.stack(),
+                        'spread': spread.stack(), 'z_score': z_score.stack()},
+                       axis=1)
+    days = peaks.assign(date=peaks['date'].dt.date).join(
+        scores, on=['date', 'user_data_id'])
+    existing = set(User_day_analytics.objects.values_list('user_data_id',
+                                                          'date'))
+    days = days[[key not in existing for key in
+                 zip(days['user_data_id'], days['date'])]]
+    days = days.astype(object).where(days.notna(), None)
+    User_day_analytics.objects.bulk_create(
+        [User_day_analytics(user_data_id=day['user_data_id'],
+                            date=day['date'], mean=day['mean'],
+                            peak=day['consumption'],
+                            peak_time=day['datetime'].time(),
+                            baseline=day['baseline'], spread=day['spread'],
+                            z_score=day['z_score'])
+         for day in days.to_dict('records')], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('consumption', '0009_populate_costs'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_analytics, migrations.RunPython.noop),
+    ]
@@ -16,9 +16,114 @@ class User_data(models.Model):
 
 class Consumption(models.Model):
 
-    user_data = models.ForeignKey(User_data, on_delete=models.CASCADE)
+    user_data = models.ForeignKey(User_data, on_delete=models.CASCADE,
+                                  db_index=False)
     datetime = models.DateTimeField(default=timezone.now)
     consumption = models.FloatField()
 
     class Meta:
         db_table = "consumption"
+        indexes = [models.Index(fields=['user_data', 'datetime'],
+                                name='consumption_user_datetime')]
+        # also serves lookups by user_data alone, so the foreign key
+        # does not get an index of its own
+
+
+class Imported_file(models.Model):
+
+    file_name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(null=True)
+    mtime = models.FloatField(null=True)
+    checksum = models.CharField(max_length=40)
+
+    class Meta:
+        db_table = "imported_file"
+
+
+class Rollup(models.Model):
+    '''Count, sum and sum of squares of the readings in one group, enough to
+       derive the mean and standard error of the group exactly, and their
+       cost under the time-of-use rates of the users' tariffs, null when
+       none of the readings is priced.'''
+
+    count = models.IntegerField(default=0)
+    total = models.FloatField(default=0)
+    total_sq = models.FloatField(default=0)
+    cost = models.FloatField(null=True)
+
+    class Meta:
+        abstract = True
+
+
+class User_day_rollup(Rollup):
+
+    user_data = models.ForeignKey(User_data, on_delete=models.CASCADE,
+                                  db_index=False)
+    date = models.DateField()
+
+    class Meta:
+        db_table = "user_day_rollup"
+        unique_together = ('user_data', 'date')
+
+
+class User_month_rollup(Rollup):
+
+    user_data = models.ForeignKey(User_data, on_delete=models.CASCADE,
+                                  db_index=False)
+    month = models.DateField()
+
+    class Meta:
+        db_table = "user_month_rollup"
+        unique_together = ('user_data', 'month')
+
+
+class Area_month_rollup(Rollup):
+
+    area = models.CharField(max_length=50)
+    month = models.DateField()
+
+    class Meta:
+        db_table = "area_month_rollup"
+        unique_together = ('area', 'month')
+
+
+class Tariff_month_rollup(Rollup):
+
+    tariff = models.CharField(max_length=50)
+    month = models.DateField()
+
+    class Meta:
+        db_table = "tariff_month_rollup"
+        unique_together = ('tariff', 'month')
+
+
+class User_day_analytics(models.Model):
+    '''Mean and peak of a user's readings on one day and how far the mean is
+       from the user's baseline, maintained by consumption.analytics.'''
+
+    user_data = models.ForeignKey(User_data, on_delete=models.CASCADE,
+                                  db_index=False)
+    date = models.DateField()
+    mean = models.FloatField(null=True)
+    peak = models.FloatField()
+    peak_time = models.TimeField()
+    baseline = models.FloatField(null=True)
+    spread = models.FloatField(null=True)
+    z_score = models.FloatField(null=True)
+
+    class Meta:
+        db_table = "user_day_analytics"
+        unique_together = ('user_data', 'date')
+        indexes = [models.Index(fields=['date'],
+                                name='user_day_analytics_date')]
+
+
+class Data_version(models.Model):
+    '''Single row which the import bumps whenever it changed the data, used
+       to invalidate cached pages.'''
+
+    version = models.IntegerField(default=0)
+    updated = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "data_version"
@@ -0,0 +1,16 @@
+'''Parsing of the raw data files. This module does not touch the database so
+   it can be used from worker processes without setting up Django.'''
+
+import os
+import pandas as pd
+
+
+def read_consumption_file(file_path):
+    '''Reads a single consumption csv into a DataFrame with the columns of
+       the consumption table, the user id is taken from the file name.'''
+    df = pd.read_csv(file_path, encoding='utf-8')
+    df['user_data_id'] = int(
+        os.path.splitext(os.path.basename(file_path))[0])
+    # adding id to consumption file before importing
+    df.datetime = pd.to_datetime(df.datetime)
+    return df[['user_data_id', 'datetime', 'consumption']]
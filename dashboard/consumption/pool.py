@@ -0,0 +1,31 @@
+'''Bounded thread pool the async API views offload their pandas and NumPy
+   work to, so the event loop keeps serving other requests meanwhile. Only
+   work which does not touch the db is offloaded, queries run through
+   sync_to_async like the rest of the sync code.'''
+
+import asyncio
+import contextvars
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+_executor = None
+
+
+def executor():
+    '''Returns the pool, created on first use with CONSUMPTION_API_WORKERS
+       threads.'''
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.CONSUMPTION_API_WORKERS,
+            thread_name_prefix='consumption-api')
+    return _executor
+
+
+async def offload(func, *args, **kwargs):
+    '''Runs func in the pool in a copy of the current context, so context
+       variables of the request are seen, and returns its result.'''
+    return await asyncio.get_running_loop().run_in_executor(
+        executor(), partial(contextvars.copy_context().run, func, *args,
+                            **kwargs))
@@ -0,0 +1,102 @@
+'''Maintenance of the rollup tables. Every imported batch is aggregated per
+   user/day, user/month, area/month and tariff/month and added to the
+   existing rollup rows, so the summary views never read the raw consumption
+   table. The cost of the readings is computed with the tariff engine on
+   the way, a group none of whose readings has a schedule has no cost.'''
+
+import numpy as np
+import pandas as pd
+from consumption.models import (User_data, User_day_rollup,
+                                User_month_rollup, Area_month_rollup,
+                                Tariff_month_rollup)
+from consumption.tariffs import costs
+
+STATS = ['count', 'total', 'total_sq', 'cost']
+
+
+def mean_sem(count, total, total_sq):
+    '''Returns the mean and the standard error of the mean (ddof=1, like
+       pandas) of groups given their count, sum and sum of squares.'''
+    count = np.asarray(count, dtype=float)
+    total = np.asarray(total, dtype=float)
+    total_sq = np.asarray(total_sq, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        variance = np.clip(total_sq - total * mean, 0, None) / (count - 1)
+        sem = np.sqrt(variance / count)
+    return mean, np.where(count > 1, sem, np.nan)
+
+
+def aggregate(frame, keys):
+    '''Returns count, sum and sum of squares of the consumption column and
+       the sum of the cost column of frame grouped by keys.'''
+    groups = frame.assign(consumption_sq=frame['consumption'] ** 2).groupby(
+        keys)
+    return (groups.agg(count=('consumption', 'size'),
+                       total=('consumption', 'sum'),
+                       total_sq=('consumption_sq', 'sum'))
+            .assign(cost=groups['cost'].sum(min_count=1))
+            .reset_index())
+
+
+def add(value, delta):
+    '''Returns the sum of a stat and a delta, None and NaN counting as no
+       value rather than 0.'''
+    if delta is None or delta != delta:
+        return value
+    return delta if value is None else value + delta
+
+
+def merge_rollup(model, keys, deltas):
+    '''Adds the rows of deltas to the matching rows of a rollup table and
+       creates the rows which do not exist yet.'''
+    lookup = {f'{key}__in': deltas[key].unique().tolist() for key in keys}
+    existing = {tuple(getattr(row, key) for key in keys): row
+                for row in model.objects.filter(**lookup)}
+    updated = []
+    created = []
+    for delta in deltas.to_dict('records'):
+        row = existing.get(tuple(delta[key] for key in keys))
+        if row is None:
+            delta['cost'] = add(None, delta['cost'])
+            created.append(model(**delta))
+            continue
+        for stat in STATS:
+            setattr(row, stat, add(getattr(row, stat), delta[stat]))
+        updated.append(row)
+    model.objects.bulk_update(updated, STATS)
+    model.objects.bulk_create(created)
+
+
+def update_rollups(batch):
+    '''Adds a batch of imported readings to all rollup tables, this should
+       run in the transaction which writes the batch.'''
+    users = pd.DataFrame(
+        list(User_data.objects
+             .filter(id__in=batch['user_data_id'].unique().tolist())
+             .values_list('id', 'area', 'tariff')),
+        columns=['user_data_id', 'area', 'tariff'])
+    frame = pd.DataFrame({
+        'user_data_id': batch['user_data_id'].astype(int),
+        'date': batch['datetime'].dt.normalize(),
+        'consumption': batch['consumption'].astype(float)})
+    frame['cost'] = costs(
+        frame['user_data_id'].map(users.set_index('user_data_id')['tariff']),
+        batch['datetime'].values, frame['consumption'].values)
+    days = aggregate(frame, ['user_data_id', 'date'])
+    days['month'] = days['date'].dt.to_period('M').dt.to_timestamp()
+    months = (days.groupby(['user_data_id', 'month'])[STATS]
+              .sum(min_count=1).reset_index())
+    days['date'] = days['date'].dt.date
+    months['month'] = months['month'].dt.date
+    # datetime keys are only converted once they are aggregated
+    merge_rollup(User_day_rollup, ['user_data_id', 'date'],
+                 days[['user_data_id', 'date'] + STATS])
+    merge_rollup(User_month_rollup, ['user_data_id', 'month'], months)
+
+    months = months.merge(users, on='user_data_id')
+    for model, key in [(Area_month_rollup, 'area'),
+                       (Tariff_month_rollup, 'tariff')]:
+        merge_rollup(model, [key, 'month'],
+                     months.groupby([key, 'month'])[STATS]
+                     .sum(min_count=1).reset_index())
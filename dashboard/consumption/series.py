@@ -0,0 +1,76 @@
+'''Vectorised aggregations over the half hourly readings of a user.'''
+
+import numpy as np
+import pandas as pd
+
+RESOLUTIONS = ['raw', 'hourly', 'daily', 'weekly', 'monthly']
+LABELS = {'raw': '%Y-%m-%d %H:%M', 'hourly': '%Y-%m-%d %H:00',
+          'daily': '%Y-%m-%d', 'weekly': '%Y-%m-%d', 'monthly': '%b-%Y'}
+MAX_POINTS = 2000
+
+
+def buckets(datetimes, resolution):
+    '''Returns the start of the hour, day, week (monday) or month each
+       datetime falls into.'''
+    index = pd.DatetimeIndex(datetimes)
+    if resolution == 'hourly':
+        return index.floor(pd.offsets.Hour())
+    if resolution == 'daily':
+        return index.floor(pd.offsets.Day())
+    if resolution == 'weekly':
+        return index.normalize() - pd.to_timedelta(index.weekday, unit='D')
+    return index.to_period('M').to_timestamp()
+
+
+def lttb(x, y, threshold):
+    '''Largest-Triangle-Three-Buckets downsampling, returns the indices of
+       the threshold points which keep the visual shape of the series. The
+       first and last point are always kept.'''
+    n = len(y)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = (np.arange(threshold - 1) * (n - 2) / (threshold - 2)
+             ).astype(int) + 1
+    edges[-1] = n - 1
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[end:next_end].mean()
+        next_y = y[end:next_end].mean()
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(area.argmax())
+        selected[i + 1] = previous
+    return selected
+
+
+def downsample(datetimes, consumption, resolution='monthly',
+               max_points=MAX_POINTS):
+    '''Returns the series of a user at the given resolution. Readings are
+       grouped into buckets with their mean, sem, min and max (raw keeps
+       the readings), None where a stat is undefined. When more than
+       max_points points remain they are reduced to max_points with LTTB on
+       the bucket means.'''
+    series = pd.Series(consumption, index=pd.DatetimeIndex(datetimes),
+                       dtype=float)
+    if resolution == 'raw':
+        stats = pd.DataFrame({'mean': series})
+    else:
+        stats = (series.groupby(buckets(series.index, resolution), sort=True)
+                 .agg(['mean', 'sem', 'min', 'max']))
+    stats = stats.iloc[lttb(stats.index.asi8, stats['mean'].values,
+                            max_points)].round(2)
+    stats = stats.astype(object).where(stats.notnull(), None)
+    # the sem of a bucket with one reading is NaN, which is not valid json
+    payload = {'x_axis': [label.strftime(LABELS[resolution])
+                          for label in stats.index],
+               'y_axis': list(stats['mean']), 'sem': []}
+    if resolution != 'raw':
+        payload.update(sem=list(stats['sem']), min=list(stats['min']),
+                       max=list(stats['max']))
+    return payload
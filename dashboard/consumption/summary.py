@@ -0,0 +1,71 @@
+'''Summary engine. Every grouping shown by the summary page and the summary
+   json (per user, date, month, area and tariff and the "All" row) comes
+   out of one UNION ALL query, a GROUPING SETS like statement in which each
+   grouping reads the smallest rollup table that answers it.
+
+   The rollups are mergeable moment sketches, the count, sum and sum of
+   squares of the readings of each group, so the mean and SEM derived from
+   them are exact.'''
+
+import datetime
+from functools import lru_cache
+import numpy as np
+from django.db import connection
+from django.db.models import CharField, Sum, Value
+from django.db.models.functions import Cast
+from consumption.models import (User_day_rollup, User_month_rollup,
+                                Area_month_rollup, Tariff_month_rollup)
+from consumption.rollups import STATS, mean_sem
+
+GROUPINGS = [('user', User_month_rollup, 'user_data_id'),
+             ('date', User_day_rollup, 'date'),
+             ('month', Area_month_rollup, 'month'),
+             ('area', Area_month_rollup, 'area'),
+             ('tariff', Tariff_month_rollup, 'tariff'),
+             ('all', Area_month_rollup, None)]
+KEYS = {'user': int,
+        'date': lambda key: datetime.date.fromisoformat(key[:10]),
+        'month': lambda key: datetime.date.fromisoformat(key[:10])}
+
+
+def grouping(dimension, model, field):
+    '''Returns the rollup rows of model grouped by field as (dimension,
+       key as text, count, total, total_sq), one row when field is None.'''
+    key = (Value('All', CharField()) if field is None
+           else Cast(field, CharField()))
+    return (model.objects
+            .annotate(dimension=Value(dimension, CharField()), key=key)
+            .values('dimension', 'key').order_by()
+            .annotate(**{stat: Sum(stat) for stat in STATS}))
+
+
+@lru_cache(maxsize=None)
+def summary_sql():
+    '''Returns the sql and params of the summary query, compiled once.'''
+    groupings = [grouping(*args) for args in GROUPINGS]
+    return (groupings[0].union(*groupings[1:], all=True)
+            .values_list('dimension', 'key', *STATS)
+            .query.sql_with_params())
+
+
+def summary_stats():
+    '''Returns the groupings of the summary query, a dict with a dict per
+       dimension holding the keys in order and arrays of their count,
+       total, total_sq, cost, mean and sem.'''
+    rows = {dimension: [] for dimension, _, _ in GROUPINGS}
+    with connection.cursor() as cursor:
+        cursor.execute(*summary_sql())
+        for dimension, key, *row in cursor.fetchall():
+            rows[dimension].append((KEYS.get(dimension, str)(key), *row))
+    stats = {}
+    for dimension, group in rows.items():
+        group.sort(key=lambda row: row[0])
+        keys, *columns = zip(*group) if group else [()] * (len(STATS) + 1)
+        group = {'key': list(keys)}
+        group.update((stat, np.array(column, dtype=float))
+                     for stat, column in zip(STATS, columns))
+        group['mean'], group['sem'] = mean_sem(group['count'],
+                                               group['total'],
+                                               group['total_sq'])
+        stats[dimension] = group
+    return stats
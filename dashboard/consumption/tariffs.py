@@ -0,0 +1,143 @@
+'''Time-of-use tariff engine. The schedules of the CONSUMPTION_TARIFFS
+   setting are expanded into a table with one row of 48 half hourly rates
+   per tariff, so the cost of any number of readings is looked up at once
+   by indexing the table with the tariff row and the half hour slot of each
+   reading. Rates are per kWh, readings are in Wh.
+
+   reprice() recomputes the cost of every rollup row from the readings in
+   the consumption table and the months archived in the columnar store. It
+   takes an app registry so that cost_sync and the migration which prices
+   the rows added before costs existed share it.'''
+
+import datetime
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import CharField
+from django.db.models.functions import Cast
+from consumption import columnar
+from consumption.export import chunks
+
+SLOTS = 48
+WH_PER_KWH = 1000
+CHUNK_SIZE = 100000
+
+
+def slot(time):
+    '''Returns the half hour slot of a 'HH:MM' time.'''
+    time = datetime.datetime.strptime(time, '%H:%M')
+    if time.minute % 30:
+        raise ImproperlyConfigured(f'Tariff band start {time:%H:%M} is not'
+                                   ' on a half hour.')
+    return time.hour * 2 + time.minute // 30
+
+
+def rate_table(tariffs=None):
+    '''Returns the tariff labels and the table of their rates, a row of
+       SLOTS rates per tariff followed by a row of NaN which unknown tariffs
+       are mapped to.'''
+    if tariffs is None:
+        tariffs = settings.CONSUMPTION_TARIFFS
+    table = np.full((len(tariffs) + 1, SLOTS), np.nan)
+    for row, bands in enumerate(tariffs.values()):
+        starts = [slot(start) for start, _ in bands]
+        if starts != sorted(starts) or starts[0] != 0:
+            raise ImproperlyConfigured('The bands of a tariff must start at'
+                                       ' 00:00 and be in order.')
+        for (start, rate), end in zip(bands, starts[1:] + [SLOTS]):
+            table[row, slot(start):end] = rate
+    return pd.Index(list(tariffs)), table
+
+
+def costs(tariffs, datetimes, consumption):
+    '''Returns the cost of readings given the tariff of their user, their
+       datetimes and consumption, NaN for tariffs without a schedule.'''
+    labels, table = rate_table()
+    minutes = (np.asarray(datetimes, dtype='datetime64[m]')
+               .astype(np.int64) % (24 * 60))
+    rates = table[labels.get_indexer(tariffs), minutes // 30]
+    # -1 of unknown tariffs selects the last row, the NaN rates
+    return np.asarray(consumption, dtype=float) / WH_PER_KWH * rates
+
+
+def set_costs(model, keys, frame):
+    '''Sets the cost of the rows of a rollup table to those of frame, which
+       holds the keys of the rows and their cost, NaN for no cost.'''
+    table = connection.ops.quote_name(model._meta.db_table)
+    where = ' AND '.join(
+        f'{connection.ops.quote_name(model._meta.get_field(key).column)}'
+        ' = %s' for key in keys)
+    rows = frame[['cost'] + keys].copy()
+    for key in keys:
+        if key in ('date', 'month'):
+            rows[key] = rows[key].dt.strftime('%Y-%m-%d')
+    rows = rows.astype(object).where(rows.notna(), None)
+    with connection.cursor() as cursor:
+        cursor.executemany(f'UPDATE {table} SET cost = %s WHERE {where}',
+                           rows.values.tolist())
+
+
+def reading_batches(apps, chunk_size):
+    '''Yields the user_data_id, datetime and consumption of all readings,
+       the archived ones from the store followed by the consumption table
+       chunk_size readings at a time.'''
+    User_data = apps.get_model('consumption', 'User_data')
+    Consumption = apps.get_model('consumption', 'Consumption')
+    yield from columnar.archived_readings(
+        User_data.objects.values_list('id', flat=True))
+    boundary = columnar.archived_before()
+    readings = Consumption.objects.all()
+    if boundary is not None:
+        readings = readings.filter(datetime__gte=boundary)
+    readings = (readings.annotate(text=Cast('datetime', CharField()))
+                .values_list('user_data_id', 'text', 'consumption')
+                .iterator(chunk_size=chunk_size))
+    for chunk in chunks(readings, chunk_size):
+        batch = pd.DataFrame(chunk, columns=['user_data_id', 'datetime',
+                                             'consumption'])
+        batch['datetime'] = pd.to_datetime(batch['datetime'],
+                                           format='ISO8601')
+        yield batch
+
+
+def reprice(apps, chunk_size=CHUNK_SIZE):
+    '''Recomputes the cost of every rollup row with the current schedules,
+       returns the number of user days priced. A row is left without cost
+       when none of its readings has a schedule.'''
+    users = pd.DataFrame(
+        list(apps.get_model('consumption', 'User_data').objects
+             .values_list('id', 'area', 'tariff')),
+        columns=['user_data_id', 'area', 'tariff'])
+    tariffs = users.set_index('user_data_id')['tariff']
+    days = []
+    for batch in reading_batches(apps, chunk_size):
+        batch['cost'] = costs(batch['user_data_id'].map(tariffs),
+                              batch['datetime'].values,
+                              batch['consumption'].values)
+        batch['date'] = batch['datetime'].dt.normalize()
+        days.append(batch.groupby(['user_data_id', 'date'])['cost']
+                    .sum(min_count=1))
+    if not days:
+        return 0
+    days = (pd.concat(days).groupby(level=[0, 1]).sum(min_count=1)
+            .reset_index())
+    # a day can be split over two batches
+    days['month'] = days['date'].dt.to_period('M').dt.to_timestamp()
+    months = (days.groupby(['user_data_id', 'month'])['cost']
+              .sum(min_count=1).reset_index().merge(users))
+    with transaction.atomic():
+        for name, keys, frame in [
+                ('User_day_rollup', ['user_data_id', 'date'], days),
+                ('User_month_rollup', ['user_data_id', 'month'], months),
+                ('Area_month_rollup', ['area', 'month'],
+                 months.groupby(['area', 'month'])['cost']
+                 .sum(min_count=1).reset_index()),
+                ('Tariff_month_rollup', ['tariff', 'month'],
+                 months.groupby(['tariff', 'month'])['cost']
+                 .sum(min_count=1).reset_index())]:
+            model = apps.get_model('consumption', name)
+            model.objects.update(cost=None)
+            set_costs(model, keys, frame)
+    return len(days)
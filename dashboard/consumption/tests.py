@@ -1,11 +1,46 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import os
+import sys
+import json
+import sqlite3
+import subprocess
 import datetime
+import tempfile
+import threading
+import tracemalloc
+from importlib import import_module
+from unittest import mock, skipIf
+import numpy as np
 import pandas as pd
-from django.test import TestCase
-from django.db.models import Sum, Avg
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test.utils import CaptureQueriesContext
+from django.test import (AsyncClient, SimpleTestCase, TestCase,
+                         override_settings)
+from django.db.models import Sum, Avg, Max
 from django.db.models.functions import TruncDate
-from consumption.models import User_data, Consumption
+from consumption.models import (User_data, Consumption, Imported_file,
+                                User_day_rollup, User_month_rollup,
+                                Area_month_rollup, Tariff_month_rollup,
+                                User_day_analytics)
+from consumption.loaders import get_loader, OrmLoader, SqliteLoader
+from consumption.forms import MAX_USERS
+from consumption.rollups import mean_sem
+from consumption.series import downsample, lttb
+from consumption.summary import summary_stats
+from consumption.tariffs import rate_table, costs
+from consumption.cache import cached, bump_data_version
+from consumption import arrays, columnar, compact
+from consumption.middleware import brotli
+from consumption.views import detail_payload
+from consumption.instrumentation import Metrics
+
+CONCURRENT_IMPORT = os.path.join(os.path.dirname(__file__), '..', '..',
+                                 'benchmarks', 'concurrent_import.py')
 
 
 class SummaryTestCase(TestCase):
@@ -177,3 +212,1156 @@ class SummaryTestCase(TestCase):
             self.assertEqual(response[data]['x_axis'], [x_axis])
             self.assertEqual(response[data]['y_axis'], [2.0])
             self.assertEqual(response[data]['sem'], [0.58])
+
+
+class ImportDataMixin(object):
+    '''Creates two users and a temporary data directory with a consumption
+       file for each of them.'''
+
+    def setUp(self):
+        self.importer = import_module(
+            'consumption.management.commands.import').Importer(batch_size=3)
+        self.importer.logger.disabled = True
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.data_dir.cleanup)
+        User_data.objects.create(id=3000, area='a1', tariff='t1')
+        User_data.objects.create(id=3001, area='a2', tariff='t2')
+        self.write_csv('3000.csv', ['2016-10-22 10:00:00,1.0',
+                                    '2016-10-22 10:30:00,2.0',
+                                    '2016-10-22 11:00:00,3.0',
+                                    '2016-10-22 11:30:00,4.0'])
+        self.write_csv('3001.csv', ['2016-10-22 10:00:00,5.0',
+                                    '2016-10-22 10:30:00,6.0'])
+
+    def write_csv(self, file_name, rows):
+        with open(os.path.join(self.data_dir.name, file_name), 'w') as f:
+            f.write('\n'.join(['datetime,consumption'] + rows) + '\n')
+
+
+class ImporterTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the import command.'''
+
+    def test_consumption_batches(self):
+        '''Test that files are regrouped into batches of at most
+           batch_size rows without losing any rows.'''
+        frames = self.importer.read_consumption_files(
+            self.importer.consumption_files(self.data_dir.name))
+        batches = list(self.importer.consumption_batches(frames))
+        self.assertEqual([len(batch) for batch in batches], [3, 3])
+        self.assertEqual(list(pd.concat(batches)['consumption']),
+                         [1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+
+    def test_import_consumption_data(self):
+        '''Test that all rows are imported and that a file which can not
+           be parsed does not abort the import.'''
+        self.write_csv('3002.csv', ['not a date,x'])
+        imported = self.importer.import_consumption_data(self.data_dir.name)
+        self.assertEqual(imported, 6)
+        self.assertEqual(Consumption.objects.filter(user_data_id=3000)
+                         .aggregate(Sum('consumption'))['consumption__sum'],
+                         10.0)
+        self.assertEqual(Consumption.objects.filter(user_data_id=3001)
+                         .count(), 2)
+
+    def test_import_consumption_data_workers(self):
+        '''Test that parsing the files in a process pool imports the same
+           rows and reports files which could not be read.'''
+        self.write_csv('3002.csv', ['not a date,x'])
+        self.importer.workers = 2
+        imported = self.importer.import_consumption_data(self.data_dir.name)
+        self.assertEqual(imported, 6)
+        self.assertEqual(self.importer.failed_files,
+                         [os.path.join(self.data_dir.name, '3002.csv')])
+        self.assertEqual(Consumption.objects.aggregate(
+            Sum('consumption'))['consumption__sum'], 21.0)
+
+    def test_incremental_import(self):
+        '''Test that an incremental import skips unchanged files and only
+           adds readings newer than the latest reading of each user.'''
+        self.importer.import_consumption_data(self.data_dir.name)
+        self.assertEqual(Imported_file.objects.count(), 2)
+        self.write_csv('3001.csv', ['2016-10-22 10:00:00,5.0',
+                                    '2016-10-22 10:30:00,6.0',
+                                    '2016-10-22 11:00:00,7.0'])
+        self.importer.incremental = True
+        self.assertEqual(self.importer.changed_files(
+            self.importer.consumption_files(self.data_dir.name)),
+            [os.path.join(self.data_dir.name, '3001.csv')])
+        self.importer.manifest = []
+        imported = self.importer.import_consumption_data(self.data_dir.name)
+        self.assertEqual(imported, 1)
+        self.assertEqual(Consumption.objects.count(), 7)
+        self.assertEqual(
+            self.importer.import_consumption_data(self.data_dir.name), 0)
+
+    def test_full_import_skips_checksums(self):
+        '''Test that an import which is not incremental records the files
+           without reading them for a checksum.'''
+        command = import_module('consumption.management.commands.import')
+        with mock.patch.object(command, 'file_checksum') as file_checksum:
+            self.importer.import_consumption_data(self.data_dir.name)
+        file_checksum.assert_not_called()
+        self.assertEqual(Imported_file.objects.count(), 2)
+
+
+class LoaderTestCase(TestCase):
+    '''This class contains methods to test the bulk loaders.'''
+
+    def setUp(self):
+        User_data.objects.create(id=1, area='a1', tariff='t2')
+        self.batch = pd.DataFrame({
+            'user_data_id': [1, 1],
+            'datetime': pd.to_datetime(['2016-10-22 10:00:00',
+                                        '2016-10-22 10:30:00']),
+            'consumption': [1.5, 2.5]})
+
+    def test_get_loader(self):
+        '''Test that the native loader of the backend is picked unless the
+           orm loader is requested.'''
+        self.assertIsInstance(get_loader(), SqliteLoader)
+        self.assertIs(type(get_loader('orm')), OrmLoader)
+
+    def test_loaders_write_the_same_rows(self):
+        '''Test that rows written by the native loader are stored exactly
+           like rows written through the orm.'''
+        for name in ['native', 'orm']:
+            Consumption.objects.all().delete()
+            with get_loader(name) as loader:
+                loader.load(self.batch)
+            self.assertEqual(
+                list(Consumption.objects
+                     .filter(datetime__gte=datetime.datetime(2016, 10, 22,
+                                                             10, 30))
+                     .values_list('user_data_id', 'datetime',
+                                  'consumption')),
+                [(1, datetime.datetime(2016, 10, 22, 10, 30), 2.5)])
+
+    def test_midnight_batch(self):
+        '''Test that a batch in which every reading is at midnight keeps
+           its time and reads back through the orm.'''
+        batch = pd.DataFrame({
+            'user_data_id': [1, 1],
+            'datetime': pd.to_datetime(['2016-07-15', '2016-07-16']),
+            'consumption': [1.5, 2.5]})
+        with get_loader() as loader:
+            loader.load(batch)
+        self.assertEqual(
+            list(Consumption.objects.order_by('datetime')
+                 .values_list('datetime', flat=True)),
+            [datetime.datetime(2016, 7, 15), datetime.datetime(2016, 7, 16)])
+
+
+class QueryPlanTestCase(TestCase):
+    '''This class contains methods to test that the queries of the views
+       are served by the consumption_user_datetime index.'''
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertIn('consumption_user_datetime', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        # rows are read in index order, no sort is needed
+
+    def test_user_readings_plan(self):
+        '''Test that the readings of a user are read in datetime order from
+           the index.'''
+        self.assertUsesIndex(Consumption.objects.filter(user_data_id=1)
+                             .order_by('datetime'))
+
+    def test_user_details_plan(self):
+        '''Test that the join used by the detail views reads the readings
+           of the user from the index.'''
+        self.assertUsesIndex(User_data.objects.select_related('user_data_id')
+                             .values('id', 'consumption__datetime',
+                                     'consumption__consumption')
+                             .filter(id=1)
+                             .order_by('consumption__datetime'))
+
+    def test_high_water_marks_plan(self):
+        '''Test that the latest reading of each user is found from the
+           index alone.'''
+        self.assertIn('COVERING INDEX consumption_user_datetime',
+                      Consumption.objects.values_list('user_data_id')
+                      .order_by('user_data_id')
+                      .annotate(Max('datetime')).explain())
+
+
+class RollupTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test that the import maintains the
+       rollup tables and that the summary views read from them.'''
+
+    def setUp(self):
+        super().setUp()
+        self.write_csv('3002.csv', ['2016-10-31 23:30:00,2.0',
+                                    '2016-11-01 00:00:00,4.0'])
+        User_data.objects.create(id=3002, area='a1', tariff='t2')
+        self.importer.import_consumption_data(self.data_dir.name)
+
+    def test_mean_sem(self):
+        '''Test that the mean and sem derived from the rollup sums match
+           pandas.'''
+        values = pd.Series([1.0, 2.0, 4.0, 8.0])
+        mean, sem = mean_sem([4], [values.sum()], [(values ** 2).sum()])
+        self.assertAlmostEqual(mean[0], values.mean())
+        self.assertAlmostEqual(sem[0], values.sem())
+        self.assertTrue(pd.isnull(mean_sem([1], [2.0], [4.0])[1][0]))
+
+    def test_rollups(self):
+        '''Test that every rollup table holds the readings of the import,
+           also when one batch spans several users.'''
+        self.assertEqual(
+            list(User_day_rollup.objects.filter(user_data_id=3002)
+                 .order_by('date').values_list('date', 'count', 'total')),
+            [(datetime.date(2016, 10, 31), 1, 2.0),
+             (datetime.date(2016, 11, 1), 1, 4.0)])
+        self.assertEqual(
+            User_month_rollup.objects.get(user_data_id=3000).total_sq, 30.0)
+        self.assertEqual(
+            list(Area_month_rollup.objects.order_by('area', 'month')
+                 .values_list('area', 'month', 'count', 'total')),
+            [('a1', datetime.date(2016, 10, 1), 5, 12.0),
+             ('a1', datetime.date(2016, 11, 1), 1, 4.0),
+             ('a2', datetime.date(2016, 10, 1), 2, 11.0)])
+        self.assertEqual(
+            list(Tariff_month_rollup.objects.order_by('tariff', 'month')
+                 .values_list('tariff', 'count')),
+            [('t1', 4), ('t2', 3), ('t2', 1)])
+
+    def test_incremental_rollups(self):
+        '''Test that new readings are added to the existing rollup
+           rows.'''
+        self.write_csv('3002.csv', ['2016-10-31 23:30:00,2.0',
+                                    '2016-11-01 00:00:00,4.0',
+                                    '2016-11-01 00:30:00,6.0'])
+        self.importer.incremental = True
+        self.importer.import_consumption_data(self.data_dir.name)
+        rollup = User_day_rollup.objects.get(
+            user_data_id=3002, date=datetime.date(2016, 11, 1))
+        self.assertEqual((rollup.count, rollup.total, rollup.total_sq),
+                         (2, 10.0, 52.0))
+
+    def test_summary_api(self):
+        '''Test that the summary graphs are built from the rollups.'''
+        month, area, tariff = self.client.get('/api/summary/').json()
+        self.assertEqual(month['x_axis'], ['Oct-2016', 'Nov-2016'])
+        self.assertEqual(month['y_axis'], [3.29, 4.0])
+        self.assertEqual(month['sem'], [0.68, None])
+        self.assertEqual(area['x_axis'], ['a1', 'a2'])
+        self.assertEqual(area['y_axis'], [2.67, 5.5])
+        self.assertEqual(area['sem'], [0.49, 0.5])
+        self.assertEqual(tariff['x_axis'], ['t1', 't2'])
+
+    def test_summary(self):
+        '''Test that the summary tables are built from the rollups.'''
+        tables = self.client.get('/summary/').context['tables']
+        self.assertEqual(len(tables), 4)
+        self.assertIn('<td>All</td>\n      <td>3.38</td>\n'
+                      '      <td>27.0</td>', tables[0])
+
+    def test_summary_stats(self):
+        '''Test that the summary engine returns every grouping from one
+           query.'''
+        with self.assertNumQueries(1):
+            stats = summary_stats()
+        self.assertEqual(stats['user']['key'], [3000, 3001, 3002])
+        self.assertEqual(stats['date']['key'][-1], datetime.date(2016, 11, 1))
+        self.assertEqual(stats['month']['key'],
+                         [datetime.date(2016, 10, 1),
+                          datetime.date(2016, 11, 1)])
+        self.assertEqual(list(stats['area']['count']), [6, 2])
+        self.assertEqual(stats['tariff']['key'], ['t1', 't2'])
+        self.assertEqual(list(stats['all']['total']), [27.0])
+        self.assertAlmostEqual(stats['month']['mean'][0], 23 / 7)
+        self.assertTrue(np.isnan(stats['month']['sem'][1]))
+
+
+class SeriesTestCase(SimpleTestCase):
+    '''This class contains methods to test the aggregations over the
+       readings of a user.'''
+
+    def test_monthly(self):
+        '''Test that the monthly buckets match the mean and sem of each
+           month in chronological order.'''
+        datetimes = pd.to_datetime(['2016-12-31 23:30:00',
+                                    '2017-01-01 00:00:00',
+                                    '2016-12-01 00:00:00',
+                                    '2017-01-01 00:30:00'])
+        series = downsample(datetimes, [1, 2, 3, 4])
+        self.assertEqual(series['x_axis'], ['Dec-2016', 'Jan-2017'])
+        self.assertEqual(series['y_axis'], [2.0, 3.0])
+        self.assertEqual(series['sem'], [1.0, 1.0])
+        self.assertEqual(series['min'], [1.0, 2.0])
+        self.assertEqual(series['max'], [3.0, 4.0])
+        self.assertEqual(downsample(datetimes[:1], [1.0])['sem'], [None])
+
+    def test_resolutions(self):
+        '''Test that readings are grouped by hour, day and week.'''
+        datetimes = pd.to_datetime(['2016-10-23 23:00:00',
+                                    '2016-10-23 23:30:00',
+                                    '2016-10-24 00:00:00'])
+        self.assertEqual(downsample(datetimes, [1, 2, 6], 'hourly')
+                         ['y_axis'], [1.5, 6.0])
+        self.assertEqual(downsample(datetimes, [1, 2, 6], 'daily')
+                         ['x_axis'], ['2016-10-23', '2016-10-24'])
+        self.assertEqual(downsample(datetimes, [1, 2, 6], 'weekly')
+                         ['x_axis'], ['2016-10-17', '2016-10-24'])
+        self.assertEqual(downsample(datetimes, [1, 2, 6], 'raw'),
+                         {'x_axis': ['2016-10-23 23:00', '2016-10-23 23:30',
+                                     '2016-10-24 00:00'],
+                          'y_axis': [1.0, 2.0, 6.0], 'sem': []})
+
+    def test_lttb(self):
+        '''Test that downsampling keeps the first and last point and the
+           peak of the series.'''
+        y = [0, 1, 0, 0, 9, 0, 0, 1, 0, 0]
+        selected = lttb(range(10), y, 4)
+        self.assertEqual(len(selected), 4)
+        self.assertEqual(list(selected[[0, -1]]), [0, 9])
+        self.assertIn(4, selected)
+        datetimes = pd.date_range('2016-10-01', periods=1000, freq='30min')
+        self.assertEqual(len(downsample(datetimes, range(1000), 'raw',
+                                        max_points=100)['x_axis']), 100)
+
+
+CACHE_DIR = tempfile.TemporaryDirectory()
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': CACHE_DIR.name}})
+class CacheTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test that pages are cached until the
+       import changes the data.'''
+
+    def setUp(self):
+        super().setUp()
+        self.importer.import_consumption_data(self.data_dir.name)
+
+    def test_cached(self):
+        '''Test that a value is built once per data version and key.'''
+        builds = []
+
+        def build():
+            builds.append(1)
+            return len(builds)
+        self.assertEqual(cached('test', build, 3000), 1)
+        self.assertEqual(cached('test', build, 3000), 1)
+        self.assertEqual(cached('test', build, 3001), 2)
+        bump_data_version()
+        self.assertEqual(cached('test', build, 3000), 3)
+
+    def test_summary_api_cached(self):
+        '''Test that a cached summary only costs the data version query
+           and that an import invalidates it.'''
+        first = self.client.get('/api/summary/').json()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/summary/').json(), first)
+        self.write_csv('3001.csv', ['2016-10-22 10:00:00,5.0',
+                                    '2016-10-22 10:30:00,6.0',
+                                    '2016-10-22 11:00:00,100.0'])
+        self.importer.incremental = True
+        self.importer.import_consumption_data(self.data_dir.name)
+        self.assertNotEqual(self.client.get('/api/summary/').json(), first)
+
+    def test_detail_search_api_cached(self):
+        '''Test that the detail json is cached per user id.'''
+        response = self.client.get('/api/detail_search/find/',
+                                   {'id_search': 3000}).json()
+        self.assertEqual(response[0]['y_axis'], [2.5])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get('/api/detail_search/find/',
+                                             {'id_search': 3000}).json(),
+                             response)
+        self.assertEqual(self.client.get('/api/detail_search/find/',
+                                         {'id_search': 3001}).json()[0]
+                         ['y_axis'], [5.5])
+
+
+@mock.patch('consumption.views.PAGE_SIZE', 3)
+class DetailSearchTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the keyset pagination of the
+       detail table.'''
+
+    def setUp(self):
+        super().setUp()
+        self.write_csv('3000.csv', ['2016-10-22 10:00:00,1.0',
+                                    '2016-10-22 10:30:00,2.0',
+                                    '2016-10-22 10:30:00,3.0',
+                                    '2016-10-22 11:00:00,4.0',
+                                    '2016-10-22 11:30:00,5.0'])
+        self.importer.import_consumption_data(self.data_dir.name)
+
+    def get_page(self, **cursor):
+        response = self.client.get('/detail_search/find/',
+                                   dict(id_search=3000, **cursor))
+        return ([row.consumption for row in response.context['user_rows']],
+                response.context['previous_cursor'],
+                response.context['next_cursor'])
+
+    def test_pages(self):
+        '''Test that the pages cover all readings in order, also when two
+           readings share a timestamp, and that each page costs the same
+           number of queries.'''
+        first, previous_cursor, next_cursor = self.get_page()
+        self.assertEqual(first, [1.0, 2.0, 3.0])
+        self.assertIsNone(previous_cursor)
+        with self.assertNumQueries(3):
+            second, previous_cursor, next_cursor = self.get_page(
+                after=next_cursor)
+        self.assertEqual(second, [4.0, 5.0])
+        self.assertIsNone(next_cursor)
+        self.assertEqual(self.get_page(before=previous_cursor)[0], first)
+
+    def test_rows_are_formatted(self):
+        '''Test that the visible rows are rendered with their user
+           details.'''
+        response = self.client.get('/detail_search/find/',
+                                   {'id_search': 3000})
+        self.assertContains(response, '<td>22/10/2016, 10:30:00</td>',
+                            count=2)
+        self.assertContains(response, '<td>a1</td>', count=3)
+
+    def test_unknown_user(self):
+        '''Test that a user which is not in the db gets a message.'''
+        response = self.client.get('/detail_search/find/',
+                                   {'id_search': 3005})
+        self.assertContains(response, 'User id 3005 is not')
+
+
+class DetailSearchApiTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the time range and resolution
+       parameters of the detail json.'''
+
+    def setUp(self):
+        super().setUp()
+        self.importer.import_consumption_data(self.data_dir.name)
+
+    def get(self, **params):
+        return self.client.get('/api/detail_search/find/',
+                               dict(id_search=3000, **params)).json()
+
+    def test_range_and_resolution(self):
+        '''Test that only readings in the range are aggregated at the
+           requested resolution.'''
+        self.assertEqual(self.get(start='2016-10-22 10:30:00',
+                                  end='2016-10-22 11:30:00',
+                                  resolution='hourly')[0]['y_axis'],
+                         [2.0, 3.0])
+        self.assertEqual(self.get(resolution='raw', points=3)[0]['y_axis'],
+                         [1.0, 2.0, 4.0])
+
+    def test_empty_range(self):
+        '''Test that a range without readings returns an empty series and
+           an unknown user an error.'''
+        self.assertEqual(self.get(start='2017-01-01')[0]['x_axis'], [])
+        self.assertIn('error', self.client.get(
+            '/api/detail_search/find/', {'id_search': 3005}).json())
+        self.assertIn('resolution', self.get(resolution='yearly')['error'])
+
+    def test_any_user_id(self):
+        '''Test that the ids are not limited to those of the sample
+           data.'''
+        User_data.objects.create(id=5000, area='a1', tariff='t1')
+        self.write_csv('5000.csv', ['2016-10-22 10:00:00,7.0'])
+        self.importer.import_consumption_data(self.data_dir.name)
+        self.assertEqual(self.client.get('/api/detail_search/find/', {
+            'id_search': 5000}).json()[0]['y_axis'], [7.0])
+
+    def test_single_reading_bucket(self):
+        '''Test that the undefined sem of a bucket with one reading is sent
+           as null, the response is strict json.'''
+        response = self.client.get('/api/detail_search/find/', {
+            'id_search': 3000, 'start': '2016-10-22 10:30:00',
+            'resolution': 'hourly'})
+
+        def reject(constant):
+            raise ValueError(constant)
+        series = json.loads(response.content, parse_constant=reject)[0]
+        self.assertEqual(series['sem'], [None, 0.5])
+
+
+class CompareApiTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the json comparing the series
+       of several users.'''
+
+    def setUp(self):
+        super().setUp()
+        self.write_csv('3001.csv', ['2016-10-22 10:00:00,5.0',
+                                    '2016-10-23 10:30:00,6.0'])
+        self.importer.import_consumption_data(self.data_dir.name)
+
+    def get(self, **params):
+        return self.client.get('/api/compare/', params).json()
+
+    def test_compare_ids(self):
+        '''Test that the series of all users are returned on a shared x
+           axis from a single grouped query.'''
+        with self.assertNumQueries(3):
+            response = self.get(ids='3001,3000', resolution='daily')
+        # one query for the data version, one counting the selected users
+        # and one for the series
+        self.assertEqual(response['x_axis'], ['2016-10-22', '2016-10-23'])
+        self.assertEqual(response['series'], [
+            {'id': 3000, 'area': 'a1', 'tariff': 't1',
+             'y_axis': [2.5, None], 'sem': [0.65, None]},
+            {'id': 3001, 'area': 'a2', 'tariff': 't2',
+             'y_axis': [5.0, 6.0], 'sem': [None, None]}])
+
+    def test_compare_filters(self):
+        '''Test that users can be selected by area or tariff and that
+           ranges within a day read the readings themselves.'''
+        response = self.get(area='a1', resolution='hourly')
+        self.assertEqual([series['id'] for series in response['series']],
+                         [3000])
+        self.assertEqual(response['series'][0]['y_axis'], [1.5, 3.5])
+        response = self.get(tariff='t1', start='2016-10-22 10:30:00')
+        self.assertEqual(response['series'][0]['y_axis'], [3.0])
+        self.assertIn('__all__', self.get(start='2016-10-22')['error'])
+
+    def test_max_users(self):
+        '''Test that the user limit applies to the users an area or tariff
+           selects, not only to explicit ids.'''
+        User_data.objects.bulk_create([
+            User_data(id=4000 + i, area='a3', tariff='t1')
+            for i in range(MAX_USERS + 1)])
+        self.assertIn('__all__', self.get(area='a3')['error'])
+        self.assertIn('__all__', self.get(tariff='t1')['error'])
+        self.assertEqual(len(self.get(area='a3', ids='4000,4001',
+                                      tariff='t1')['series']), 0)
+
+
+class ExportTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the streaming exports.'''
+
+    def setUp(self):
+        super().setUp()
+        self.importer.import_consumption_data(self.data_dir.name)
+
+    def export(self, fmt, **params):
+        response = self.client.get(f'/api/export/{fmt}/', params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_csv(self):
+        '''Test that the selected readings are exported as csv in user and
+           datetime order.'''
+        self.assertEqual(
+            self.export('csv', area='a2').splitlines(),
+            ['user_data_id,datetime,consumption',
+             '3001,2016-10-22 10:00:00,5.0', '3001,2016-10-22 10:30:00,6.0'])
+        self.assertEqual(len(self.export('csv').splitlines()), 7)
+
+    def test_export_ndjson(self):
+        '''Test that readings are exported as one json object per
+           line.'''
+        lines = self.export('ndjson', ids='3000',
+                            start='2016-10-22 11:00:00').splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'user_data_id': 3000, 'datetime': '2016-10-22 11:00:00',
+             'consumption': 3.0},
+            {'user_data_id': 3000, 'datetime': '2016-10-22 11:30:00',
+             'consumption': 4.0}])
+
+    def test_export_invalid(self):
+        '''Test that invalid filters are rejected.'''
+        self.assertEqual(self.client.get('/api/export/csv/',
+                                         {'ids': 'x'}).status_code, 400)
+
+
+@skipIf(columnar.pa is None, 'pyarrow is not installed')
+class ColumnarTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the columnar store.'''
+
+    def setUp(self):
+        super().setUp()
+        store_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(store_dir.cleanup)
+        settings = override_settings(CONSUMPTION_COLUMNAR_DIR=store_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.write_csv('3001.csv', ['2016-09-30 23:30:00,5.0',
+                                    '2016-10-22 10:30:00,6.0'])
+        self.importer.import_consumption_data(self.data_dir.name)
+        self.syncer = import_module(
+            'consumption.management.commands.columnar_sync').Syncer()
+        self.syncer.logger.disabled = True
+
+    def test_import_writes_partitions(self):
+        '''Test that imported readings are stored per user and month and
+           aggregated with partition pruning.'''
+        stats = columnar.user_month_stats()
+        self.assertEqual(stats[['user_data_id', 'month', 'count']]
+                         .values.tolist(),
+                         [[3000, '2016-10', 4], [3001, '2016-09', 1],
+                          [3001, '2016-10', 1]])
+        self.assertEqual(stats['total'].tolist(), [10.0, 5.0, 6.0])
+        self.assertEqual(columnar.user_month_stats(
+            [3001], start=datetime.datetime(2016, 10, 1))['total'].tolist(),
+            [6.0])
+        datetimes, consumption = columnar.read_user(
+            3000, datetime.datetime(2016, 10, 22, 10, 30),
+            datetime.datetime(2016, 10, 22, 11, 30))
+        self.assertEqual(consumption.tolist(), [2.0, 3.0])
+
+    def test_reads_list_user_only(self):
+        '''Test that reading a user lists the directory of that user, not
+           the whole store.'''
+        with mock.patch('consumption.columnar.os.listdir',
+                        wraps=os.listdir) as listdir:
+            datetimes, consumption = columnar.read_user(
+                3001, start=datetime.datetime(2016, 10, 1))
+        self.assertEqual(consumption.tolist(), [6.0])
+        self.assertEqual([os.path.basename(call.args[0])
+                          for call in listdir.call_args_list], ['user=3001'])
+        self.assertEqual(columnar.read_user(3999)[1].tolist(), [])
+
+    def test_sync_and_archive(self):
+        '''Test that missing partitions are rebuilt from the db and that
+           archived months are still served from the store.'''
+        os.remove(columnar.partition_path(3000, '2016-10'))
+        self.assertEqual(self.syncer.mismatched_months(), [(3000, '2016-10')])
+        self.assertEqual(self.syncer.sync(), 1)
+        self.assertEqual(self.syncer.mismatched_months(), [])
+        self.assertEqual(self.syncer.archive('2016-10-15'), 1)
+        self.assertEqual(Consumption.objects.count(), 5)
+        response = self.client.get('/api/detail_search/find/',
+                                   {'id_search': 3001,
+                                    'resolution': 'raw'}).json()
+        self.assertEqual(response[0]['y_axis'], [5.0, 6.0])
+
+    def test_archived_reads(self):
+        '''Test that the detail table, the export and the comparison read
+           the archived months from the store and the rest from the db.'''
+        self.syncer.archive('2016-10-15')
+        self.assertEqual(columnar.archived_before(),
+                         datetime.datetime(2016, 10, 1))
+        with mock.patch('consumption.views.PAGE_SIZE', 1):
+            pages = []
+            cursor = {}
+            while cursor is not None:
+                response = self.client.get('/detail_search/find/',
+                                           dict(id_search=3001, **cursor))
+                pages.append([row.consumption for row in
+                              response.context['user_rows']])
+                cursor = response.context['next_cursor']
+                cursor = None if cursor is None else {'after': cursor}
+            self.assertEqual(pages, [[5.0], [6.0]])
+            response = self.client.get('/detail_search/find/', {
+                'id_search': 3001,
+                'before': response.context['previous_cursor']})
+            self.assertEqual([row.consumption for row in
+                              response.context['user_rows']], [5.0])
+        export = b''.join(self.client.get('/api/export/csv/', {
+            'area': 'a2'}).streaming_content).decode()
+        self.assertEqual(export.splitlines()[1:],
+                         ['3001,2016-09-30 23:30:00,5.0',
+                          '3001,2016-10-22 10:30:00,6.0'])
+        export = b''.join(self.client.get(
+            '/api/export/csv/').streaming_content).decode()
+        self.assertEqual(len(export.splitlines()), 7)
+        for params, y_axis in [({'resolution': 'hourly'}, [5.0, 6.0]),
+                               ({'start': '2016-09-30 12:00:00'},
+                                [5.0, 6.0]),
+                               ({'start': '2016-09-30'}, [5.0, 6.0])]:
+            response = self.client.get('/api/compare/',
+                                       dict(ids='3001', **params)).json()
+            self.assertEqual(response['series'][0]['y_axis'], y_axis)
+
+    def test_archived_analytics(self):
+        '''Test that analytics_sync rebuilds the days of archived months
+           from the store.'''
+        rows = list(User_day_analytics.objects.order_by(
+            'user_data_id', 'date').values_list('user_data_id', 'date',
+                                                'peak'))
+        self.syncer.archive('2016-10-15')
+        call_command('analytics_sync', verbosity=0)
+        self.assertEqual(list(User_day_analytics.objects.order_by(
+            'user_data_id', 'date').values_list('user_data_id', 'date',
+                                                'peak')), rows)
+        self.assertIn((3001, datetime.date(2016, 9, 30), 5.0), rows)
+
+    @override_settings(CONSUMPTION_TARIFFS={'t2': [('00:00', 500.0)]})
+    def test_archived_costs(self):
+        '''Test that cost_sync prices the archived months from the store.'''
+        call_command('cost_sync', verbosity=0)
+        self.syncer.archive('2016-10-15')
+        call_command('cost_sync', verbosity=0)
+        self.assertEqual(list(User_month_rollup.objects.filter(
+            user_data_id=3001).order_by('month').values_list('cost',
+                                                             flat=True)),
+                         [2.5, 3.0])
+
+
+class ArrayStoreTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the per-user array store.'''
+
+    def setUp(self):
+        super().setUp()
+        store_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(store_dir.cleanup)
+        settings = override_settings(CONSUMPTION_ARRAY_DIR=store_dir.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.importer.import_consumption_data(self.data_dir.name)
+
+    def test_read_user(self):
+        '''Test that imported readings are sliced from the mapped file
+           without copies.'''
+        datetimes, consumption = arrays.read_user(
+            3000, datetime.datetime(2016, 10, 22, 10, 30),
+            datetime.datetime(2016, 10, 22, 11, 30))
+        self.assertIsInstance(consumption, np.memmap)
+        self.assertEqual(consumption.dtype, np.float32)
+        self.assertEqual(consumption.tolist(), [2.0, 3.0])
+        self.assertEqual(str(datetimes[0]), '2016-10-22T10:30:00')
+        self.assertEqual(len(arrays.read_user(3005)[0]), 0)
+
+    def test_detail_payload(self):
+        '''Test that the detail json from the store matches the one from
+           the consumption table, also after a rebuild.'''
+        payload = detail_payload(3000, resolution='hourly')
+        with override_settings(CONSUMPTION_ARRAY_DIR=None):
+            self.assertEqual(payload, detail_payload(3000,
+                                                     resolution='hourly'))
+        os.remove(arrays.user_path(3000))
+        call_command('array_sync', verbosity=0)
+        self.assertEqual(arrays.read_user(3000)[1].tolist(),
+                         [1.0, 2.0, 3.0, 4.0])
+
+
+class AsyncApiTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the async API views.'''
+
+    def setUp(self):
+        super().setUp()
+        self.importer.import_consumption_data(self.data_dir.name)
+
+    async def test_asgi_requests(self):
+        '''Test that the API views answer through the ASGI handler.'''
+        client = AsyncClient()
+        response = await client.get('/api/detail_search/find/',
+                                    {'id_search': 3000})
+        self.assertEqual(response.json()[0]['y_axis'], [2.5])
+        response = await client.get('/api/summary/')
+        self.assertEqual(response.json()[1]['x_axis'], ['a1', 'a2'])
+        response = await client.get('/api/compare/', {'ids': 3000})
+        self.assertEqual(response.json()['series'][0]['y_axis'], [2.5])
+
+    @mock.patch('consumption.views.EXPORT_CHUNK_SIZE', 2)
+    async def test_asgi_export(self):
+        '''Test that the whole export is streamed through the ASGI handler,
+           chunk by chunk without buffering it.'''
+        response = await AsyncClient().get('/api/export/csv/')
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(b''.join(chunks).decode().splitlines(), [
+            'user_data_id,datetime,consumption',
+            '3000,2016-10-22 10:00:00,1.0', '3000,2016-10-22 10:30:00,2.0',
+            '3000,2016-10-22 11:00:00,3.0', '3000,2016-10-22 11:30:00,4.0',
+            '3001,2016-10-22 10:00:00,5.0', '3001,2016-10-22 10:30:00,6.0'])
+
+    def test_downsample_is_offloaded(self):
+        '''Test that series are downsampled in the pool threads.'''
+        threads = []
+
+        def downsample(*args):
+            threads.append(threading.current_thread().name)
+            return {}
+        with mock.patch('consumption.views.downsample', downsample):
+            self.client.get('/api/detail_search/find/',
+                            {'id_search': 3001, 'resolution': 'daily'})
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('consumption-api'))
+
+
+class WarmCacheTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the warm_cache command.'''
+
+    def setUp(self):
+        super().setUp()
+        self.importer.import_consumption_data(self.data_dir.name)
+        self.warmer = import_module(
+            'consumption.management.commands.warm_cache').Warmer(workers=1)
+        self.warmer.logger.disabled = True
+
+    def test_warm(self):
+        '''Test that every artifact is built and timed and that requests
+           afterwards only query the data version.'''
+        timings = self.warmer.warm()
+        self.assertEqual([name for name, _ in timings],
+                         ['summary tables', 'summary json',
+                          'detail json 3000', 'detail json 3001'])
+        for path, params in [('/summary/', {}), ('/api/summary/', {}),
+                             ('/api/detail_search/find/',
+                              {'id_search': 3001})]:
+            with self.assertNumQueries(1):
+                self.assertEqual(self.client.get(path, params).status_code,
+                                 200)
+
+
+@override_settings(CONSUMPTION_INSTRUMENTATION=True,
+                   CONSUMPTION_INSTRUMENTATION_MEMORY=True)
+@mock.patch('consumption.instrumentation.metrics', new_callable=Metrics)
+class InstrumentationTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the instrumentation
+       middleware.'''
+
+    def setUp(self):
+        super().setUp()
+        self.importer.import_consumption_data(self.data_dir.name)
+        self.addCleanup(tracemalloc.stop)
+        # started by the first recorded request
+
+    def server_timing(self, path, params=None):
+        return dict(metric.split(';', 1) for metric in self.client.get(
+            path, params)['Server-Timing'].split(', '))
+
+    def test_server_timing(self, metrics):
+        '''Test that queries and the named stages of sync and async views
+           are reported.'''
+        with CaptureQueriesContext(connection) as queries:
+            timing = self.server_timing('/summary/')
+        self.assertIn(f'desc="{len(queries)} queries"', timing['sql'])
+        for name in ['total', 'summary.frames', 'summary.to_html',
+                     'summary.render', 'mem']:
+            self.assertIn(name, timing)
+        timing = self.server_timing('/api/detail_search/find/',
+                                    {'id_search': 3000})
+        self.assertIn('detail.readings', timing)
+        self.assertIn('detail.downsample', timing)
+        # recorded in the pool thread
+
+    def test_metrics(self, metrics):
+        '''Test that the metrics are served in the Prometheus text
+           format.'''
+        self.client.get('/summary/')
+        self.client.get('/summary/')
+        lines = self.client.get('/metrics/').content.decode().splitlines()
+        self.assertIn('# TYPE consumption_requests_total counter', lines)
+        self.assertIn('consumption_requests_total{view="summary"} 2', lines)
+        self.assertIn('consumption_request_duration_seconds_count'
+                      '{view="summary"} 2', lines)
+        self.assertTrue(any(line.startswith(
+            'consumption_stage_duration_seconds_total{view="summary",'
+            'stage="summary.to_html"}') for line in lines))
+
+    def test_metrics_access(self, metrics):
+        '''Test that the metrics are only served to the allowed
+           addresses.'''
+        self.assertEqual(self.client.get(
+            '/metrics/', REMOTE_ADDR='10.0.0.5').status_code, 403)
+        with override_settings(CONSUMPTION_METRICS_IPS=['10.0.0.5']):
+            self.assertEqual(self.client.get(
+                '/metrics/', REMOTE_ADDR='10.0.0.5').status_code, 200)
+
+    def test_disabled(self, metrics):
+        '''Test that nothing is recorded unless enabled.'''
+        with override_settings(CONSUMPTION_INSTRUMENTATION=False):
+            self.assertNotIn('Server-Timing', self.client.get('/summary/'))
+            self.assertEqual(self.client.get('/metrics/').status_code, 404)
+        with override_settings(CONSUMPTION_INSTRUMENTATION_MEMORY=False):
+            self.client = self.client_class()
+            self.assertNotIn('mem', self.server_timing('/summary/'))
+
+
+class ApiResponseTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the conditional, compressed and
+       compact responses of the graph APIs.'''
+
+    def setUp(self):
+        super().setUp()
+        self.write_csv('3000.csv', [f'2016-10-22 {hour:02d}:{minute}:00,'
+                                    f'{hour}.5' for hour in range(24)
+                                    for minute in ['00', '30']])
+        self.importer.import_consumption_data(self.data_dir.name)
+
+    def test_not_modified(self):
+        '''Test that a client holding the current data version gets 304
+           until the next import.'''
+        response = self.client.get('/api/summary/')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(self.client.get(
+            '/api/summary/', HTTP_IF_NONE_MATCH=response['ETag']
+        ).status_code, 304)
+        self.assertEqual(self.client.get(
+            '/api/compare/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        ).status_code, 304)
+        bump_data_version()
+        self.assertEqual(self.client.get(
+            '/api/summary/', HTTP_IF_NONE_MATCH=response['ETag']
+        ).status_code, 200)
+
+    def test_gzip(self):
+        '''Test that large responses are gzipped with a weak ETag which
+           still matches.'''
+        path = '/api/detail_search/find/?id_search=3000&resolution=raw'
+        response = self.client.get(path, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response['ETag'].startswith('W/"'))
+        self.assertEqual(self.client.get(
+            path, HTTP_ACCEPT_ENCODING='gzip',
+            HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    @skipIf(brotli is None, 'brotli is not installed')
+    def test_brotli(self):
+        response = self.client.get('/api/summary/',
+                                   HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+
+    def test_compact(self):
+        '''Test that the compact encoding decodes to the json payload,
+           None included.'''
+        for path in ['/api/summary/?',
+                     '/api/detail_search/find/?id_search=3000&'
+                     'resolution=hourly&']:
+            response = self.client.get(path + 'format=compact')
+            self.assertEqual(response['Content-Type'], compact.CONTENT_TYPE)
+            self.assertEqual(compact.decode(response.content),
+                             self.client.get(path).json())
+        payload = [{'x_axis': ['a', 'b'], 'y_axis': [1.25, 2.5],
+                    'sem': [None, 0.5]}, {'x_axis': [], 'y_axis': [],
+                                          'sem': []}]
+        self.assertEqual(compact.decode(compact.encode(payload)), payload)
+
+
+class DatabaseProfileTestCase(SimpleTestCase):
+    '''This class contains methods to test the sqlite pragmas of the
+       production profile on a db file and the import running next to API
+       reads.'''
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def connect(self):
+        wrapper = DatabaseWrapper(dict(
+            connection.settings_dict,
+            NAME=os.path.join(self.directory.name, 'profile.sqlite3'),
+            OPTIONS={'timeout': 0.1}), alias='profile')
+        wrapper.connect()
+        self.addCleanup(wrapper.close)
+        return wrapper.connection
+
+    def read_while_writing(self):
+        '''Returns the readings a reader sees while a writer holds an
+           exclusive transaction inserting more of them.'''
+        writer = self.connect()
+        writer.execute('CREATE TABLE reading (value REAL)')
+        writer.execute('INSERT INTO reading VALUES (1.0)')
+        writer.execute('BEGIN EXCLUSIVE')
+        writer.executemany('INSERT INTO reading VALUES (?)',
+                           [(float(i),) for i in range(1000)])
+        try:
+            return self.connect().execute(
+                'SELECT COUNT(*) FROM reading').fetchone()[0]
+        finally:
+            writer.execute('COMMIT')
+
+    @override_settings(CONSUMPTION_SQLITE_PRAGMAS={
+        'journal_mode': 'WAL', 'synchronous': 'NORMAL',
+        'mmap_size': '1048576'})
+    def test_production_pragmas(self):
+        '''Test that new connections get the pragmas and that readers see
+           the committed data while a writer is in a transaction.'''
+        pragmas = self.connect()
+        self.assertEqual(pragmas.execute('PRAGMA journal_mode').fetchone(),
+                         ('wal',))
+        self.assertEqual(pragmas.execute('PRAGMA synchronous').fetchone(),
+                         (1,))
+        self.assertEqual(self.read_while_writing(), 1)
+
+    @override_settings(CONSUMPTION_SQLITE_PRAGMAS={})
+    def test_development_locks(self):
+        '''Test that the rollback journal blocks readers, which the
+           production profile avoids.'''
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+            self.read_while_writing()
+
+    def test_import_with_api_reads(self):
+        '''Test that in the production profile the summary and detail
+           json requested while the import runs in a thread never fail
+           with "database is locked", on a db file and with a lock timeout
+           short enough to expose any blocked read.'''
+        output = subprocess.run(
+            [sys.executable, CONCURRENT_IMPORT, '--child', '--users', '2',
+             '--years', '1', '--timeout', '0.05'],
+            env=dict(os.environ, DB_PROFILE='production'), check=True,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+        result = json.loads(output.decode().splitlines()[-1])
+        self.assertEqual(result['profile'], 'production')
+        self.assertGreater(result['reads'], 0)
+        self.assertEqual(result['locked'], 0)
+
+
+class AnalyticsTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the daily peaks and anomaly
+       scores maintained by the import.'''
+
+    def setUp(self):
+        super().setUp()
+        self.write_csv('3000.csv', [
+            f'2016-10-{day:02d} {time},{value + day % 2}'
+            for day in range(1, 11)
+            for time, value in [('08:00:00', 1.0), ('18:00:00', 3.0)]]
+            + ['2016-10-11 08:00:00,1.0', '2016-10-11 19:00:00,20.0'])
+        self.importer.import_consumption_data(self.data_dir.name)
+
+    def day(self, date):
+        return User_day_analytics.objects.get(user_data_id=3000, date=date)
+
+    def test_scores(self):
+        '''Test that every day gets its peak, merged across batches, and a
+           z-score against the days before it.'''
+        spike = self.day(datetime.date(2016, 10, 11))
+        self.assertEqual((spike.mean, spike.peak, spike.peak_time),
+                         (10.5, 20.0, datetime.time(19, 0)))
+        means = pd.Series([2.0 + day % 2 for day in range(1, 11)])
+        self.assertAlmostEqual(spike.baseline, means.mean())
+        self.assertAlmostEqual(spike.z_score,
+                               (10.5 - means.mean()) / means.std())
+        self.assertEqual(self.day(datetime.date(2016, 10, 2)).peak_time,
+                         datetime.time(18, 0))
+        self.assertIsNone(self.day(datetime.date(2016, 10, 3)).z_score)
+        # fewer than MIN_DAYS days before it
+
+    def test_incremental(self):
+        '''Test that an incremental import scores the new days only and
+           matches a rebuild of the whole fleet.'''
+        with open(os.path.join(self.data_dir.name, '3000.csv'), 'a') as f:
+            f.write('2016-10-12 08:00:00,2.0\n2016-10-12 18:00:00,4.0\n')
+        self.importer.incremental = True
+        with mock.patch('consumption.analytics.User_day_rollup.objects',
+                        wraps=User_day_rollup.objects) as rollups:
+            self.importer.import_consumption_data(self.data_dir.name)
+        self.assertEqual(rollups.filter.call_args[1]['date__gte'],
+                         datetime.date(2016, 9, 14))
+        rows = list(User_day_analytics.objects.order_by('user_data_id',
+                                                        'date').values())
+        self.assertIsNotNone(rows[-2]['z_score'])
+        # 2016-10-12, the last day of 3000
+        call_command('analytics_sync', verbosity=0)
+        self.assertEqual([dict(row, id=None) for row in rows],
+                         [dict(row, id=None) for row in
+                          User_day_analytics.objects.order_by(
+                              'user_data_id', 'date').values()])
+
+    def test_populate_analytics(self):
+        '''Test that the migration adding the analytics builds the same
+           days as the import for the readings imported before.'''
+        rows = list(User_day_analytics.objects.order_by(
+            'user_data_id', 'date').values())
+        User_day_analytics.objects.exclude(user_data_id=3001,
+                                           date__gte='2016-10-05').delete()
+        import_module('consumption.migrations.0010_populate_analytics'
+                      ).populate_analytics(apps, None)
+        self.assertEqual([dict(row, id=None) for row in rows],
+                         [dict(row, id=None) for row in
+                          User_day_analytics.objects.order_by(
+                              'user_data_id', 'date').values()])
+
+    def test_anomalies_api(self):
+        '''Test that the days beyond the threshold are listed.'''
+        response = self.client.get('/api/anomalies/',
+                                   {'ids': '3000,3001'}).json()
+        self.assertEqual(response['anomalies'], [
+            {'user_data_id': 3000, 'date': '2016-10-11', 'mean': 10.5,
+             'baseline': 2.5, 'z_score': 15.18, 'peak': 20.0,
+             'peak_time': '19:00'}])
+        self.assertEqual(self.client.get(
+            '/api/anomalies/', {'area': 'a2'}).json()['anomalies'], [])
+        self.assertIn('z', self.client.get('/api/anomalies/',
+                                           {'z': -1}).json()['error'])
+
+
+@override_settings(CONSUMPTION_TARIFFS={
+    't1': [('00:00', 1000.0), ('11:00', 2000.0)], 't2': [('00:00', 500.0)]})
+class TariffTestCase(ImportDataMixin, TestCase):
+    '''This class contains methods to test the time-of-use costs computed
+       at import.'''
+
+    def setUp(self):
+        super().setUp()
+        User_data.objects.create(id=3002, area='a1', tariff='t9')
+        self.write_csv('3002.csv', ['2016-10-22 10:00:00,7.0'])
+        self.importer.import_consumption_data(self.data_dir.name)
+
+    def test_rate_table(self):
+        '''Test that the bands are expanded into half hourly rates and
+           that unknown tariffs cost NaN.'''
+        labels, table = rate_table()
+        self.assertEqual(list(labels), ['t1', 't2'])
+        self.assertEqual(table.shape, (3, 48))
+        self.assertEqual((table[0, 21], table[0, 22], table[0, 47]),
+                         (1000.0, 2000.0, 2000.0))
+        self.assertTrue(np.isnan(table[2]).all())
+        np.testing.assert_array_equal(
+            costs(['t1', 't9'], np.array(['2016-10-22T23:30'],
+                                         'datetime64[s]').repeat(2),
+                  [2.0, 2.0]), [4.0, np.nan])
+        with self.assertRaises(ImproperlyConfigured):
+            rate_table({'t1': [('00:00', 1.0), ('11:15', 2.0)]})
+
+    @override_settings(CONSUMPTION_TARIFFS={'t3': [
+        ('00:00', 0.12), ('07:00', 0.22), ('16:00', 0.40), ('19:00', 0.22)]})
+    def test_bill(self):
+        '''Test that readings in Wh are billed at rates per kWh.'''
+        User_data.objects.create(id=3003, area='a3', tariff='t3')
+        data_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(data_dir.cleanup)
+        with open(os.path.join(data_dir.name, '3003.csv'), 'w') as f:
+            f.write('datetime,consumption\n2016-10-23 06:30:00,500.0\n'
+                    '2016-10-23 17:00:00,1000.0\n'
+                    '2016-10-23 20:00:00,250.0\n')
+        self.importer.import_consumption_data(data_dir.name)
+        # 0.5kWh at 0.12, 1kWh at 0.40 and 0.25kWh at 0.22
+        self.assertAlmostEqual(User_day_rollup.objects.get(
+            user_data_id=3003).cost, 0.06 + 0.40 + 0.055)
+        self.assertEqual(self.client.get('/api/summary/').json()[2]['cost'],
+                         [17.0, 5.5, 0.52, None])
+
+    def test_import_costs(self):
+        '''Test that every rollup table holds the cost of its readings and
+           that readings without a schedule have no cost.'''
+        self.assertEqual(dict(User_month_rollup.objects.values_list(
+            'user_data_id', 'cost')), {3000: 17.0, 3001: 5.5, 3002: None})
+        self.assertEqual(dict(Area_month_rollup.objects.values_list(
+            'area', 'cost')), {'a1': 17.0, 'a2': 5.5})
+        self.assertEqual(dict(Tariff_month_rollup.objects.values_list(
+            'tariff', 'cost')), {'t1': 17.0, 't2': 5.5, 't9': None})
+
+    def test_cost_sync(self):
+        '''Test that cost_sync reprices the readings with the current
+           schedules.'''
+        with override_settings(CONSUMPTION_TARIFFS={
+                't1': [('00:00', 3000.0)], 't9': [('00:00', 1000.0)]}):
+            call_command('cost_sync', verbosity=0, chunk_size=4)
+        self.assertEqual(dict(User_day_rollup.objects.values_list(
+            'user_data_id', 'cost')), {3000: 30.0, 3001: None, 3002: 7.0})
+        self.assertEqual(dict(Area_month_rollup.objects.values_list(
+            'area', 'cost')), {'a1': 37.0, 'a2': None})
+
+    def test_populate_costs(self):
+        '''Test that the migration adding costs prices the rollups of the
+           readings imported before with its own schedules.'''
+        for model in [User_day_rollup, User_month_rollup, Area_month_rollup,
+                      Tariff_month_rollup]:
+            model.objects.update(cost=0)
+        import_module('consumption.migrations.0009_populate_costs'
+                      ).populate_costs(apps, None)
+        # 10Wh at 0.20 for t1, 11Wh at 0.25 for t2, t9 has no schedule
+        users = dict(User_month_rollup.objects.values_list('user_data_id',
+                                                           'cost'))
+        self.assertAlmostEqual(users[3000], 0.002)
+        self.assertAlmostEqual(users[3001], 0.00275)
+        self.assertIsNone(users[3002])
+        self.assertAlmostEqual(Area_month_rollup.objects.get(
+            area='a1').cost, 0.002)
+
+    def test_summary_cost(self):
+        '''Test that the summary reports the cost by area and tariff.'''
+        month, area, tariff = self.client.get('/api/summary/').json()
+        self.assertEqual(area['cost'], [17.0, 5.5])
+        self.assertEqual(tariff['cost'], [17.0, 5.5, None])
+        tables = self.client.get('/summary/').context['tables']
+        self.assertIn('<th>Total Cost</th>', tables[2])
+        self.assertNotIn('<th>Total Cost</th>', tables[0])
@@ -8,5 +8,10 @@ urlpatterns = [
     re_path(r'^detail_search/find/$', views.detail_search,
             name='detail_search'),
     re_path(r'^api/detail_search/find/$', views.detail_search_api),
-    re_path(r'^api/summary/$', views.summary_api)
+    re_path(r'^api/summary/$', views.summary_api),
+    re_path(r'^api/compare/$', views.compare_api),
+    re_path(r'^api/anomalies/$', views.anomalies_api),
+    re_path(r'^api/export/(?P<fmt>csv|ndjson)/$', views.export,
+            name='export'),
+    re_path(r'^metrics/$', views.metrics, name='metrics')
 ]
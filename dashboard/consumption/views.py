@@ -1,17 +1,44 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import datetime
+from collections import namedtuple
+from itertools import groupby, repeat
+from operator import itemgetter
+import numpy as np
 import pandas as pd
-from django.http import JsonResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (Http404, HttpResponse, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import render
-from django.db.models import Sum, Avg
-from django.db.models.functions import TruncDate
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from consumption.forms import Search
-from consumption.models import User_data, Consumption
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import (TruncHour, TruncDay, TruncWeek,
+                                       TruncMonth)
+from consumption import arrays, columnar, compact, instrumentation
+from consumption.cache import cached, cached_async, conditional
+from consumption.export import (EXPORT_FORMATS, EXPORT_CONTENT_TYPES,
+                                EXPORT_CHUNK_SIZE, in_sync_thread)
+from consumption.pool import offload
+from consumption.instrumentation import stage
+from consumption.forms import (Search, Page, Range, Selection, Compare,
+                               Anomalies)
+from consumption.models import (User_data, Consumption, User_day_rollup,
+                                User_day_analytics)
+from consumption.analytics import Z_THRESHOLD
+from consumption.rollups import mean_sem
+from consumption.series import downsample, buckets, LABELS, MAX_POINTS
+from consumption.summary import summary_stats
 
 LAYOUT_HTML = 'consumption/layout.html'
 SUMMARY_HTML = 'consumption/summary.html'
 DETAIL_HTML = 'consumption/detail.html'
+PAGE_SIZE = 200
+MAX_ANOMALIES = 1000
+TRUNCATE = {'hourly': TruncHour, 'daily': TruncDay, 'weekly': TruncWeek,
+            'monthly': TruncMonth}
+Reading = namedtuple('Reading', ['id', 'datetime', 'consumption'])
 
 
 def front_page(request):
@@ -25,166 +52,517 @@ def detail(request):
 
 
 def summary(request):
-    '''Creates tables summarising data in the db.'''
+    '''Renders the summary tables, cached until the next import.'''
+    tables = cached('summary', summary_tables)
+    with stage('summary.render'):
+        return render(request, SUMMARY_HTML, {'tables': tables})
+
+
+def summary_tables():
+    '''Creates tables summarising data in the db, all groupings come from
+       the single query of the summary engine, which is shared with
+       summary_payload through the cache. The area and tariff tables show
+       the cost precomputed at import.'''
     tables = []
-    queries = {
-        'user_data_id': list(Consumption.objects.values('user_data_id')
-                             .order_by('user_data_id')
-                             .annotate(Average_consumption=Avg('consumption'),
-                                       Total_consumption=Sum('consumption'))
-                             # average and total consumption of all users
-                             ),
-        'Date': list(Consumption.objects.annotate(Date=TruncDate('datetime'))
-                     .values('Date').order_by('Date')
-                     .annotate(Average_consumption=Avg('consumption'),
-                               Total_consumption=Sum('consumption'))
-                     # average and total consumption for each date
-                     ),
-        'area': list(User_data.objects.select_related('user_data_id')
-                     .values('area').order_by('area')
-                     .annotate(
-                         Average_consumption=Avg('consumption__consumption'),
-                         Total_consumption=Sum('consumption__consumption'))
-                     # average and total consumption for each area
-                     ),
-        'tariff': list(User_data.objects.select_related('user_data_id')
-                       .values('tariff').order_by('tariff')
-                       .annotate(
-                           Average_consumption=Avg('consumption__consumption'),
-                           Total_consumption=Sum('consumption__consumption'))
-                       # average and total consumption for each tariff
-                       )}
-
-    for header, data in queries.items():
-        df = pd.DataFrame(data)[[header, 'Average_consumption',
-                                 'Total_consumption']]
-        if header == 'user_data_id':
-            df.loc[len(df) + 1] = [
-                'All',
-                Consumption.objects.values('consumption')
-                .aggregate(Avg('consumption'))['consumption__avg'],
-                Consumption.objects.values('consumption')
-                .aggregate(Sum('consumption'))['consumption__sum']
-                ]
-        df['Average_consumption'] = round(df['Average_consumption'], 2)
-        df['Total_consumption'] = round(df['Total_consumption'], 2)
-        df = df.rename(columns={'user_data_id': 'User ID',
-                                'Average_consumption': 'Average Consumption',
-                                'Total_consumption': 'Total Consumption',
-                                'area': 'Area', 'tariff': 'Tariff'})
-        tables.append(df.to_html(index=False, justify='left'))
+    stats = cached('summary_stats', summary_stats)
+    headers = {'user': 'user_data_id', 'date': 'Date', 'area': 'area',
+               'tariff': 'tariff'}
+    for dimension, header in headers.items():
+        with stage('summary.frames'):
+            group = stats[dimension]
+            keys, count, total = group['key'], group['count'], group['total']
+            if dimension == 'user':
+                keys = keys + ['All']
+                count = np.append(count, stats['all']['count'])
+                total = np.append(total, stats['all']['total'])
+            df = pd.DataFrame({header: keys, 'count': count,
+                               'Total_consumption': total})
+            df['Average_consumption'] = round(
+                df['Total_consumption'] / df['count'], 2)
+            df['Total_consumption'] = round(df['Total_consumption'], 2)
+            columns = [header, 'Average_consumption', 'Total_consumption']
+            if dimension in ('area', 'tariff'):
+                df['Total_cost'] = np.round(group['cost'], 2)
+                columns.append('Total_cost')
+            df = df[columns]
+            df = df.rename(columns={'user_data_id': 'User ID',
+                                    'Average_consumption':
+                                    'Average Consumption',
+                                    'Total_consumption': 'Total Consumption',
+                                    'Total_cost': 'Total Cost',
+                                    'area': 'Area', 'tariff': 'Tariff'})
+        with stage('summary.to_html'):
+            tables.append(df.to_html(index=False, justify='left',
+                                     na_rep=''))
         del df
-    return render(request, SUMMARY_HTML, {'tables': tables})
+    return tables
 
 
 def detail_search(request):
     '''Creates a table that shows all available data for a specific
-       user id, this is inputted by the user via the web app.'''
+       user id, this is inputted by the user via the web app. The table is
+       paginated with keyset cursors so only the rows of one page are read
+       and formatted.'''
     form = Search(request.GET)
-    page = request.GET.get('page', 1)
-    if form.is_valid():
-        id_search = form.cleaned_data['id_search']
-        data = list(User_data.objects.select_related('user_data_id')
-                    .values('id', 'area', 'tariff',
-                            'consumption__datetime',
-                            'consumption__consumption')
-                    .filter(id=id_search)
-                    .order_by('consumption__datetime')
-                    )
-    if not data:
+    if not form.is_valid():
+        return render(request, DETAIL_HTML, {'form': form})
+    id_search = form.cleaned_data['id_search']
+    user = User_data.objects.filter(id=id_search).first()
+    if user is None:
         return render(request, DETAIL_HTML,
                       {'form': form, 'no_id':
                        f'<p class="comments"> User id {id_search} is not'
                        ' present in our database.</p>'})
-    df = pd.DataFrame(data)
-    df['Month'] = pd.to_datetime(
-        df['consumption__datetime']).dt.strftime('%b-%Y')
-    df['consumption__datetime'] = pd.to_datetime(
-        df['consumption__datetime']).dt.strftime('%d/%m/%Y, %T')
-    user_data = df.to_dict(orient='records')
-    paginator = Paginator(user_data, 200)
-    try:
-        user_rows = paginator.page(page)
-    except PageNotAnInteger:
-        user_rows = paginator.page(1)
-    except EmptyPage:
-        user_rows = paginator.page(paginator.num_pages)
+    page = Page(request.GET)
+    cursors = page.cleaned_data if page.is_valid() else {}
+    user_rows, previous_cursor, next_cursor = reading_page(
+        id_search, after=cursors.get('after'), before=cursors.get('before'))
     return render(request, DETAIL_HTML, {'user_rows': user_rows, 'form': form,
-                                         'user_id': id_search})
+                                         'user': user, 'user_id': id_search,
+                                         'previous_cursor': previous_cursor,
+                                         'next_cursor': next_cursor})
 
 
-def detail_search_api(request):
-    '''Creates json data which is used to create JS graphs which show
-       consumption over time (months) for a specific user.'''
-    consumption_data = []
-    sem = []
-    data = []
+def reading_page(user_id, after=None, before=None):
+    '''Returns one page of readings of a user in (datetime, id) order and
+       the cursors of the previous and next page (None at either end). The
+       page starts after the reading with id after or ends before the
+       reading with id before, so every page is one range read of at most
+       PAGE_SIZE + 1 rows on the (user_data, datetime) index. Readings of
+       archived months come first, from the columnar store, and have their
+       datetime as cursor.'''
+    boundary = columnar.archived_before()
+    readings = Consumption.objects.filter(user_data_id=user_id)
+    if boundary is not None:
+        readings = readings.filter(datetime__gte=boundary)
+    cursor = after or before
+    archived = isinstance(cursor, datetime.datetime)
+    if cursor is not None and not archived:
+        cursor = readings.filter(id=cursor).first()
+    if cursor is not None and before:
+        rows = []
+        if not archived:
+            rows = list(readings.filter(
+                Q(datetime__lt=cursor.datetime) |
+                Q(datetime=cursor.datetime, id__lt=cursor.id))
+                .order_by('-datetime', '-id')[:PAGE_SIZE + 1])[::-1]
+        if boundary is not None and len(rows) <= PAGE_SIZE:
+            rows = archived_readings(
+                user_id, before=cursor if archived else boundary,
+                limit=PAGE_SIZE + 1 - len(rows)) + rows
+        has_previous, has_next = len(rows) > PAGE_SIZE, True
+        rows = rows[-PAGE_SIZE:]
+    else:
+        rows = []
+        if boundary is not None and (cursor is None or archived):
+            rows = archived_readings(user_id, after=cursor, before=boundary,
+                                     limit=PAGE_SIZE + 1, last=False)
+        if len(rows) <= PAGE_SIZE:
+            if cursor is not None and not archived:
+                readings = readings.filter(
+                    Q(datetime__gt=cursor.datetime) |
+                    Q(datetime=cursor.datetime, id__gt=cursor.id))
+            rows += list(readings.order_by('datetime', 'id')
+                         [:PAGE_SIZE + 1 - len(rows)])
+        has_previous, has_next = cursor is not None, len(rows) > PAGE_SIZE
+        rows = rows[:PAGE_SIZE]
+    if not rows:
+        return rows, None, None
+    return (rows, page_cursor(rows[0]) if has_previous else None,
+            page_cursor(rows[-1]) if has_next else None)
+
+
+def page_cursor(row):
+    '''Returns the cursor of a row of reading_page.'''
+    return row.datetime if row.id is None else row.id
+
+
+def archived_readings(user_id, after=None, before=None, limit=None,
+                      last=True):
+    '''Returns the first or last limit archived readings of a user after
+       the datetime after and before the datetime before as Readings
+       without id.'''
+    datetimes, consumption = columnar.read_user(user_id, after, before)
+    if after is not None:
+        newer = datetimes > np.datetime64(after)
+        datetimes, consumption = datetimes[newer], consumption[newer]
+    rows = slice(-limit, None) if last else slice(None, limit)
+    return [Reading(None, value, reading) for value, reading in zip(
+        datetimes[rows].astype('datetime64[us]').tolist(),
+        consumption[rows].tolist())]
+
+
+@conditional
+async def detail_search_api(request):
+    '''Returns the json data of detail_payload for the user id, time range
+       and resolution in the request, cached per parameters until the next
+       import.'''
+    data = None
     id_search = None
     form = Search(request.GET)
+    series = Range(request.GET)
+    if not series.is_valid():
+        return JsonResponse({'error': series.errors})
     if form.is_valid():
         id_search = form.cleaned_data['id_search']
-        data = list(User_data.objects.select_related('user_data_id')
-                    .values('id', 'consumption__datetime',
-                            'consumption__consumption')
-                    .filter(id=id_search)
-                    .order_by('consumption__datetime')
-                    )
+        options = detail_options(**series.cleaned_data)
+        data = await cached_async(
+            'detail_search_api',
+            lambda: detail_payload_async(id_search, **options),
+            id_search, *options.values())
     if not data:
         return JsonResponse({'error': f'User ID {id_search} is an'
                              ' invalid id.'})
-    df = pd.DataFrame(data)
-    df['month'] = pd.to_datetime(
-        df['consumption__datetime']).dt.strftime('%b-%Y')
-    for i in df['month'].unique():
-        consumption_data.append(df['consumption__consumption'].where(
-            df['month'] == i).mean().round(2))
-        sem.append(df['consumption__consumption'].where(
-            df['month'] == i).sem().round(2))
-    response = JsonResponse([{'x_axis':  list(df['month'].unique()),
-                             'y_axis': consumption_data, 'sem': sem}],
-                            safe=False)
+    return graph_response(request, data)
+
+
+def detail_options(start=None, end=None, resolution=None, points=None):
+    '''Returns the detail_payload options of a Range with the defaults
+       filled in, in the order their values are used in cache keys.'''
+    return {'start': start, 'end': end,
+            'resolution': resolution or 'monthly',
+            'max_points': points or MAX_POINTS}
+
+
+def detail_payload(id_search, start=None, end=None, resolution='monthly',
+                   max_points=MAX_POINTS):
+    '''Creates json data which is used to create JS graphs which show
+       consumption over time for a specific user, from start (inclusive) to
+       end (exclusive) at the given resolution with at most max_points
+       points. None when the user is not in the db.'''
+    with stage('detail.readings'):
+        datetimes, consumption = user_readings(id_search, start, end)
+    if (not len(datetimes)
+            and not User_data.objects.filter(id=id_search).exists()):
+        return None
+    with stage('detail.downsample'):
+        return [downsample(datetimes, consumption, resolution, max_points)]
+
+
+async def detail_payload_async(id_search, start=None, end=None,
+                               resolution='monthly', max_points=MAX_POINTS):
+    '''detail_payload for the async view, the readings are fetched in the
+       thread of the sync code and downsampled in the pool.'''
+    with stage('detail.readings'):
+        datetimes, consumption = await sync_to_async(user_readings)(
+            id_search, start, end)
+    if not len(datetimes) and not await sync_to_async(
+            User_data.objects.filter(id=id_search).exists)():
+        return None
+    with stage('detail.downsample'):
+        return [await offload(downsample, datetimes, consumption, resolution,
+                              max_points)]
+
+
+def user_readings(user_id, start=None, end=None):
+    '''Returns the datetimes and consumption of a user's readings from start
+       (inclusive) to end (exclusive). They are sliced from the array store
+       or read from the columnar store, which also hold the months archived
+       out of the consumption table, when these are enabled.'''
+    if arrays.enabled():
+        return arrays.read_user(user_id, start, end)
+    if columnar.enabled():
+        return columnar.read_user(user_id, start, end)
+    readings = Consumption.objects.filter(user_data_id=user_id)
+    if start:
+        readings = readings.filter(datetime__gte=start)
+    if end:
+        readings = readings.filter(datetime__lt=end)
+    data = list(readings.order_by('datetime')
+                .values_list('datetime', 'consumption'))
+    return tuple(zip(*data)) if data else ([], [])
+
+
+@conditional
+async def compare_api(request):
+    '''Returns the json data of compare_payload for the users, time range
+       and resolution in the request, cached per parameters until the next
+       import.'''
+    form = Compare(request.GET)
+    if not await sync_to_async(form.is_valid)():
+        # the selected users are counted in the db
+        return JsonResponse({'error': form.errors})
+    options = {'ids': form.cleaned_data['ids'],
+               'area': form.cleaned_data['area'],
+               'tariff': form.cleaned_data['tariff'],
+               'start': form.cleaned_data['start'],
+               'end': form.cleaned_data['end'],
+               'resolution': form.cleaned_data['resolution'] or 'monthly'}
+    return JsonResponse(await cached_async(
+        'compare_api', lambda: compare_payload_async(**options),
+        *[','.join(map(str, options['ids']))] + list(options.values())[1:]))
+
+
+@conditional
+async def anomalies_api(request):
+    '''Returns the json data of anomalies_payload for the users, time range
+       and threshold in the request, cached per parameters until the next
+       import.'''
+    form = Anomalies(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'error': form.errors})
+    options = dict(form.cleaned_data)
+    if options['z'] is None:
+        options['z'] = Z_THRESHOLD
+    return JsonResponse(await cached_async(
+        'anomalies_api',
+        lambda: sync_to_async(anomalies_payload)(**options),
+        *[','.join(map(str, options['ids']))] + list(options.values())[1:]))
+
+
+def anomalies_payload(ids=None, area=None, tariff=None, start=None,
+                      end=None, z=Z_THRESHOLD):
+    '''Creates json data listing the days of the selected users whose mean
+       consumption is at least z standard deviations from the user's
+       baseline, with the peak of the day, at most MAX_ANOMALIES of them
+       ordered by date.'''
+    days = list(select(User_day_analytics.objects.all(), 'date', ids, area,
+                       tariff, start, end)
+                .filter(Q(z_score__gte=z) | Q(z_score__lte=-z))
+                .order_by('date', 'user_data_id')
+                .values('user_data_id', 'date', 'mean', 'baseline',
+                        'z_score', 'peak', 'peak_time')[:MAX_ANOMALIES + 1])
+    anomalies = [dict(day, mean=round(day['mean'], 2),
+                      baseline=round(day['baseline'], 2),
+                      z_score=round(day['z_score'], 2),
+                      peak_time=day['peak_time'].strftime('%H:%M'))
+                 for day in days[:MAX_ANOMALIES]]
+    return {'anomalies': anomalies, 'truncated': len(days) > MAX_ANOMALIES}
+
+
+def select(readings, date, ids=None, area=None, tariff=None, start=None,
+           end=None):
+    '''Filters a queryset of readings or rollups to the users with the
+       given ids, area and tariff and the range from start (inclusive) to
+       end (exclusive) of its date field.'''
+    if ids:
+        readings = readings.filter(user_data_id__in=ids)
+    if area:
+        readings = readings.filter(user_data__area=area)
+    if tariff:
+        readings = readings.filter(user_data__tariff=tariff)
+    if start:
+        readings = readings.filter(**{f'{date}__gte': start})
+    if end:
+        readings = readings.filter(**{f'{date}__lt': end})
+    return readings
+
+
+def compare_payload(ids=None, area=None, tariff=None, start=None, end=None,
+                    resolution='monthly'):
+    '''Creates json data with the mean and sem of the consumption of each
+       selected user per hour, day, week or month, on one shared x axis.
+       Users are selected by id, area and tariff, all users are aggregated
+       with a single grouped query, on the daily rollups unless the buckets
+       or the range need the readings themselves.'''
+    with stage('compare.rows'):
+        rows = compare_rows(ids, area, tariff, start, end, resolution)
+    with stage('compare.series'):
+        return compare_series(rows, resolution)
+
+
+async def compare_payload_async(ids=None, area=None, tariff=None, start=None,
+                                end=None, resolution='monthly'):
+    '''compare_payload for the async view, the rows are fetched in the
+       thread of the sync code and aligned in the pool.'''
+    with stage('compare.rows'):
+        rows = await sync_to_async(compare_rows)(ids, area, tariff, start,
+                                                 end, resolution)
+    with stage('compare.series'):
+        return await offload(compare_series, rows, resolution)
+
+
+def compare_rows(ids=None, area=None, tariff=None, start=None, end=None,
+                 resolution='monthly'):
+    '''Returns count, sum and sum of squares of the selected readings per
+       user and bucket of the resolution.'''
+    whole_days = all(bound is None or bound == bound.replace(
+        hour=0, minute=0, second=0, microsecond=0) for bound in [start, end])
+    if resolution != 'hourly' and whole_days:
+        readings = User_day_rollup.objects.all()
+        date = 'date'
+        stats = {'count': Sum('count'), 'total': Sum('total'),
+                 'total_sq': Sum('total_sq')}
+        # whole days can be read from the daily rollups
+    else:
+        readings = Consumption.objects.all()
+        date = 'datetime'
+        stats = {'count': Count('id'), 'total': Sum('consumption'),
+                 'total_sq': Sum(F('consumption') * F('consumption'))}
+    archived, current = ((None, (start, end)) if date == 'date'
+                         else columnar.split(start, end))
+    rows = []
+    if current is not None:
+        readings = select(readings, date, ids, area, tariff, *current)
+        rows = list(readings.annotate(bucket=TRUNCATE[resolution](date))
+                    .values('user_data_id', 'user_data__area',
+                            'user_data__tariff', 'bucket')
+                    .order_by().annotate(**stats))
+    if archived is not None:
+        rows += archived_compare_rows(selected_users(ids, area, tariff),
+                                      *archived, resolution)
+    return rows
+
+
+def archived_compare_rows(users, start=None, end=None, resolution='monthly'):
+    '''compare_rows of the archived readings of the users, read from the
+       columnar store.'''
+    frame = columnar.read_users(list(users), start, end)
+    if frame.empty:
+        return []
+    frame['bucket'] = buckets(frame['datetime'], resolution)
+    frame['consumption_sq'] = frame['consumption'] ** 2
+    stats = (frame.groupby(['user_data_id', 'bucket'])
+             .agg(count=('consumption', 'count'),
+                  total=('consumption', 'sum'),
+                  total_sq=('consumption_sq', 'sum')).reset_index())
+    stats['user_data__area'] = stats['user_data_id'].map(
+        lambda user_id: users[user_id][0])
+    stats['user_data__tariff'] = stats['user_data_id'].map(
+        lambda user_id: users[user_id][1])
+    stats['bucket'] = stats['bucket'].dt.to_pydatetime()
+    return stats.astype(object).to_dict('records')
+
+
+def selected_users(ids=None, area=None, tariff=None):
+    '''Returns the area and tariff of the users with the given ids, area and
+       tariff by user id, in id order.'''
+    users = User_data.objects.order_by('id')
+    if ids:
+        users = users.filter(id__in=ids)
+    if area:
+        users = users.filter(area=area)
+    if tariff:
+        users = users.filter(tariff=tariff)
+    return {user_id: (user_area, user_tariff) for user_id, user_area,
+            user_tariff in users.values_list('id', 'area', 'tariff')}
+
+
+def compare_series(rows, resolution='monthly'):
+    '''Returns the mean and sem of every user of rows from compare_rows on
+       the shared x axis of their buckets.'''
+    keys = ['user_data_id', 'user_data__area', 'user_data__tariff', 'bucket']
+    df = pd.DataFrame(rows, columns=keys + ['count', 'total', 'total_sq'])
+    df = df.groupby(keys, as_index=False)[['count', 'total',
+                                           'total_sq']].sum()
+    # a bucket can hold archived readings and readings in the db
+    df['mean'], df['sem'] = mean_sem(df['count'], df['total'],
+                                     df['total_sq'])
+    df[['mean', 'sem']] = df[['mean', 'sem']].round(2)
+    x_axis = sorted(df['bucket'].unique())
+    series = []
+    for (user_id, user_area, user_tariff), user in df.groupby(
+            ['user_data_id', 'user_data__area', 'user_data__tariff']):
+        user = user.set_index('bucket').reindex(x_axis)
+        user = user[['mean', 'sem']].astype(object).where(user.notnull(),
+                                                           None)
+        # buckets without readings are null so the series stay aligned
+        series.append({'id': user_id, 'area': user_area,
+                       'tariff': user_tariff,
+                       'y_axis': list(user['mean']),
+                       'sem': list(user['sem'])})
+    return {'x_axis': [pd.Timestamp(bucket).strftime(LABELS[resolution])
+                       for bucket in x_axis],
+            'series': series}
+
+
+def export(request, fmt):
+    '''Streams the readings of the selected users and range as csv or
+       ndjson. Rows are fetched in chunks in (user, datetime) index order and
+       written as they arrive, so memory stays flat for any export size.
+       Archived months are read from the columnar store user by user. Under
+       ASGI the chunks are produced in the thread of the sync code.'''
+    form = Selection(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'error': form.errors}, status=400)
+    options = form.cleaned_data
+    archived, current = columnar.split(options['start'], options['end'])
+    readings = iter(())
+    if current is not None:
+        readings = (select(Consumption.objects.all(), 'datetime',
+                           options['ids'], options['area'],
+                           options['tariff'], *current)
+                    .order_by('user_data_id', 'datetime')
+                    .values_list('user_data_id', 'datetime', 'consumption')
+                    .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+    if archived is not None:
+        readings = with_archived(readings, selected_users(
+            options['ids'], options['area'], options['tariff']), *archived)
+    chunks = EXPORT_FORMATS[fmt](readings, EXPORT_CHUNK_SIZE)
+    if isinstance(request, ASGIRequest):
+        chunks = in_sync_thread(chunks)
+    response = StreamingHttpResponse(chunks,
+                                     content_type=EXPORT_CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = ('attachment;'
+                                       f' filename="consumption.{fmt}"')
     return response
 
 
-def summary_api(request):
+def with_archived(readings, user_ids, start=None, end=None):
+    '''Yields the archived readings of every user in user_ids from start to
+       end, read from the columnar store one user at a time, followed by
+       the readings of the user in readings, which are in user order.'''
+    readings = groupby(readings, key=itemgetter(0))
+    user_readings = next(readings, None)
+    for user_id in user_ids:
+        datetimes, consumption = columnar.read_user(user_id, start, end)
+        yield from zip(repeat(user_id),
+                       datetimes.astype('datetime64[us]').tolist(),
+                       consumption.tolist())
+        if user_readings is not None and user_readings[0] == user_id:
+            yield from user_readings[1]
+            user_readings = next(readings, None)
+
+
+@conditional
+async def summary_api(request):
+    '''Returns the json data of summary_payload, cached until the next
+       import. The payload is grouped in the db and only holds one row per
+       month, area and tariff, so it is built in the thread of the sync
+       code.'''
+    return graph_response(request, await cached_async(
+        'summary_api', sync_to_async(summary_payload)))
+
+
+def graph_response(request, data):
+    '''Returns a list of graphs as json or, with format=compact, in the
+       compact columnar encoding.'''
+    if request.GET.get('format') == 'compact':
+        return HttpResponse(compact.encode(data),
+                            content_type=compact.CONTENT_TYPE)
+    return JsonResponse(data, safe=False)
+
+
+def summary_payload():
     '''Creates json data which is used to create JS graphs to
-       summarise data in the db.'''
-    response = {
-        'month_data': {'x_axis': [], 'y_axis': [], 'sem': []},
-        'area_data': {'x_axis': [], 'y_axis': [], 'sem': []},
-        'tariff_data': {'x_axis': [], 'y_axis': [], 'sem': []}
-                }
-    queries = {
-        'month': list(Consumption.objects
-                      .values('datetime', 'consumption')
-                      .order_by('datetime')
-                      # consumption for each date
-                      ),
-        'area': list(User_data.objects.select_related('user_data_id')
-                     .values('area', 'consumption__consumption')
-                     .order_by('area')
-                     # consumption for each area
-                     ),
-        'tariff': list(User_data.objects.select_related('user_data_id')
-                       .values('tariff', 'consumption__consumption')
-                       .order_by('tariff')
-                       # consumption for each tariff
-                       )}
-    for data_type, data in queries.items():
-        df = pd.DataFrame(data)
-        df = df.rename(columns={'consumption__consumption': 'consumption'})
-        if 'datetime' in df.columns and len(df.columns) == 2:
-            df['month'] = pd.to_datetime(
-                df['datetime']).dt.strftime('%b-%Y')
-        response[f'{data_type}_data']['x_axis'] = list(df[data_type].unique())
-        for i in df[data_type].unique():
-            response[f'{data_type}_data']['y_axis'].append(
-                df['consumption'].where(df[data_type] == i)
-                .mean().round(2))
-            response[f'{data_type}_data']['sem'].append(
-                df['consumption'].where(df[data_type] == i)
-                .sem().round(2))
-        del df
-    response = JsonResponse([response['month_data'], response['area_data'],
-                             response['tariff_data']], safe=False)
+       summarise data in the db, from the single query of the summary
+       engine, with the total cost of each month, area and tariff.'''
+    stats = cached('summary_stats', summary_stats)
+    response = []
+    for dimension in ['month', 'area', 'tariff']:
+        # consumption for each month, area and tariff
+        frame = stats[dimension]
+        x_axis = list(frame['key'])
+        if dimension == 'month':
+            x_axis = [month.strftime('%b-%Y') for month in x_axis]
+        graph = {
+            'x_axis': x_axis,
+            'y_axis': [round(mean, 2) for mean in frame['mean']],
+            'sem': [None if pd.isnull(sem) else round(sem, 2)
+                    for sem in frame['sem']],
+            'cost': [None if pd.isnull(cost) else round(cost, 2)
+                     for cost in frame['cost']]}
+        response.append(graph)
     return response
+
+
+def metrics(request):
+    '''Serves the metrics of the instrumentation middleware in the
+       Prometheus text format, only when CONSUMPTION_INSTRUMENTATION is
+       set and only to the addresses in CONSUMPTION_METRICS_IPS.'''
+    if not settings.CONSUMPTION_INSTRUMENTATION:
+        raise Http404
+    if request.META.get('REMOTE_ADDR') not in settings.CONSUMPTION_METRICS_IPS:
+        raise PermissionDenied
+    return HttpResponse(instrumentation.metrics.render(),
+                        content_type='text/plain; version=0.0.4')
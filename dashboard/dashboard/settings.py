@@ -41,6 +41,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'consumption.middleware.InstrumentationMiddleware',
+    'consumption.middleware.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -70,17 +72,128 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'dashboard.wsgi.application'
 
+ASGI_APPLICATION = 'dashboard.asgi.application'
+
 
 # Database
 # https://docs.djangoproject.com/en/1.11/ref/settings/#databases
 
-DATABASES = {
+# DB_PROFILE selects the database settings:
+# - development (default): sqlite with a connection per request and the
+#   default rollback journal.
+# - production: sqlite with persistent connections, and pragmas applied to
+#   every new connection (WAL, so the import does not block readers,
+#   synchronous=NORMAL, a 64MB page cache and 256MB of mmap I/O).
+# - postgresql: the DB_NAME, DB_USER, DB_PASSWORD, DB_HOST and DB_PORT
+#   database with persistent connections. Set DB_POOLED=1 when DB_HOST is
+#   a transaction pooling PgBouncer, this turns off server-side cursors,
+#   which do not survive across pooled transactions.
+
+DB_PROFILE = os.environ.get('DB_PROFILE', 'development')
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+
+if DB_PROFILE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'dashboard'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'DISABLE_SERVER_SIDE_CURSORS': bool(os.environ.get('DB_POOLED')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        }
+    }
+if DB_PROFILE == 'production':
+    DATABASES['default'].update(CONN_MAX_AGE=DB_CONN_MAX_AGE,
+                                OPTIONS={'timeout': 30})
+    # a writer waits up to 30s for another writer instead of failing
+
+# Pragmas set on every new sqlite connection by consumption.db
+
+CONSUMPTION_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': '-65536',
+    'mmap_size': str(256 * 2 ** 20),
+    'temp_store': 'MEMORY',
+} if DB_PROFILE == 'production' else {}
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# The consumption views cache their tables and json payloads until the next
+# import. The local-memory backend evicts the least recently used entries
+# once MAX_ENTRIES is reached, a file-based backend can be configured with
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache and
+# CACHE_LOCATION=/path/to/dir.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'consumption'),
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('CACHE_MAX_ENTRIES', 1000)),
+        },
     }
 }
 
+# Directory of the optional columnar store of the readings (requires
+# pyarrow), disabled when empty
+
+CONSUMPTION_COLUMNAR_DIR = os.environ.get('CONSUMPTION_COLUMNAR_DIR') or None
+
+# Directory of the optional per-user array store read by the detail json,
+# disabled when empty
+
+CONSUMPTION_ARRAY_DIR = os.environ.get('CONSUMPTION_ARRAY_DIR') or None
+
+# Time-of-use rate schedules per tariff label, used to precompute the cost
+# of the readings at import. A schedule is a list of (start, rate) bands in
+# half hour steps, each lasting until the next start, the last one until
+# midnight. Rates are per kWh of the readings, which are in Wh. Users whose
+# tariff has no schedule have no cost.
+
+CONSUMPTION_TARIFFS = {
+    't1': [('00:00', 0.20)],
+    't2': [('00:00', 0.10), ('07:00', 0.25)],
+    't3': [('00:00', 0.12), ('07:00', 0.22), ('16:00', 0.40),
+           ('19:00', 0.22)],
+}
+
+# Number of threads the async API views offload pandas and NumPy work to
+
+CONSUMPTION_API_WORKERS = int(os.environ.get('CONSUMPTION_API_WORKERS', 4))
+
+# Records SQL and named stages of the consumption views in Server-Timing
+# headers and the metrics/ endpoint when set, with the peak memory of each
+# request when CONSUMPTION_INSTRUMENTATION_MEMORY is set too (tracemalloc,
+# slow)
+
+CONSUMPTION_INSTRUMENTATION = bool(os.environ.get(
+    'CONSUMPTION_INSTRUMENTATION'))
+CONSUMPTION_INSTRUMENTATION_MEMORY = bool(os.environ.get(
+    'CONSUMPTION_INSTRUMENTATION_MEMORY'))
+
+# Client addresses allowed to read the metrics/ endpoint, comma separated in
+# CONSUMPTION_METRICS_IPS, the local host by default. Behind a reverse proxy
+# REMOTE_ADDR is the proxy, so restrict the path there too
+
+CONSUMPTION_METRICS_IPS = os.environ.get('CONSUMPTION_METRICS_IPS',
+                                         '127.0.0.1,::1').split(',')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
@@ -110,8 +223,6 @@ TIME_ZONE = 'UTC'
 
 USE_I18N = True
 
-USE_L10N = True
-
 USE_TZ = False
 
 